@@ -0,0 +1,18 @@
+import tempfile
+import wave
+from typing import List
+
+def capture_frames(stream, job, chunk: int):
+    """Lee bloques de chunk frames de stream en job.frames mientras job.grabando sea True."""
+    while job.grabando:
+        job.frames.append(stream.read(chunk, exception_on_overflow=False))
+
+def save_wav(frames: List[bytes], channels: int, sample_width: int, rate: int) -> str:
+    """Escribe los frames capturados en un WAV temporal y devuelve su ruta."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
+        with wave.open(temp_file, 'wb') as wf:
+            wf.setnchannels(channels)
+            wf.setsampwidth(sample_width)
+            wf.setframerate(rate)
+            wf.writeframes(b''.join(frames))
+        return temp_file.name
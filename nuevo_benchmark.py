@@ -0,0 +1,376 @@
+"""Benchmark de latencia del pipeline de dictado y del historial.
+
+Reproduce ficheros WAV a través de la misma secuencia que un dictado real
+(captura -> transcribe_audio -> enhance_text -> add_transcription) usando un
+backend de Gemini simulado con latencia configurable, y mide las operaciones
+de TranscriptionHistory con 1k/10k/100k entradas. Los resultados se escriben
+en JSON para poder compararlos entre versiones:
+
+    python nuevo_benchmark.py --salida bench.json
+    python nuevo_benchmark.py --fixtures grabaciones/ --comparar bench_anterior.json
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import nuevo_text_enhancer
+from nuevo_audio import capture_frames, save_wav
+from nuevo_text_enhancer import TextEnhancer
+from nuevo_transcription_history import TranscriptionHistory
+
+# Mismos parámetros de captura que nuevo_mainsoft.py
+CHUNK = 1024
+CHANNELS = 1
+RATE = 44100
+SAMPLE_WIDTH = 2
+
+HISTORY_SIZES = [1000, 10000, 100000]
+
+
+class _SimulatedFile:
+    def __init__(self, name, size):
+        self.name = name
+        self.display_name = name
+        self.size_bytes = size
+
+
+class _SimulatedUsage:
+    def __init__(self, prompt_tokens, output_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+        self.total_token_count = prompt_tokens + output_tokens
+
+
+class _SimulatedResponse:
+    def __init__(self, text, prompt_tokens=0):
+        self.text = text
+        # Estimación aproximada: ~4 caracteres por token
+        self.usage_metadata = _SimulatedUsage(prompt_tokens, len(text) // 4)
+
+
+class _SimulatedModel:
+    def __init__(self, backend, model_name):
+        self.backend = backend
+        self.model_name = model_name
+
+    def count_tokens(self, contents):
+        self.backend._connect()
+        return len(str(contents)) // 4
+
+    def generate_content(self, contents):
+        self.backend._connect()
+        if isinstance(contents, list):
+            # Transcripción: [prompt, archivo]
+            time.sleep(self.backend.transcribe_latency)
+            audio_seconds = contents[-1].size_bytes / (RATE * SAMPLE_WIDTH)
+            words = max(1, int(audio_seconds * 2.5))
+            # Gemini cuenta 32 tokens por segundo de audio
+            prompt_tokens = len(contents[0]) // 4 + int(audio_seconds * 32)
+            return _SimulatedResponse(" ".join(["palabra"] * words), prompt_tokens)
+        # Mejora: prompt + texto
+        time.sleep(self.backend.enhance_latency)
+        return _SimulatedResponse(contents.rsplit("\n", 1)[-1].strip().capitalize(), len(contents) // 4)
+
+
+class SimulatedGenAI:
+    """Sustituto del módulo google.generativeai con latencias simuladas."""
+
+    def __init__(self, upload_bandwidth, transcribe_latency, enhance_latency, connect_latency=0.0):
+        self.upload_bandwidth = upload_bandwidth
+        self.transcribe_latency = transcribe_latency
+        self.enhance_latency = enhance_latency
+        self.connect_latency = connect_latency
+        self._uploads = 0
+        # Instante hasta el que la conexión sigue abierta (el servidor la cierra tras IDLE_TIMEOUT)
+        self._open_until = 0.0
+
+    IDLE_TIMEOUT = 60.0
+
+    def _connect(self):
+        """Simula el coste de DNS + TLS si la conexión se cerró por inactividad."""
+        now = time.monotonic()
+        if now >= self._open_until:
+            time.sleep(self.connect_latency)
+        self._open_until = time.monotonic() + self.IDLE_TIMEOUT
+
+    def close_connections(self):
+        self._open_until = 0.0
+
+    def configure(self, api_key=None, **kwargs):
+        pass
+
+    def list_models(self):
+        return []
+
+    def get_model(self, name):
+        self._connect()
+        return name
+
+    def list_files(self, page_size=None):
+        self._connect()
+        return iter([])
+
+    def upload_file(self, path):
+        self._connect()
+        size = os.path.getsize(path)
+        time.sleep(size / self.upload_bandwidth)
+        self._uploads += 1
+        return _SimulatedFile(f"files/bench-{self._uploads}", size)
+
+    def delete_file(self, name):
+        pass
+
+    def GenerativeModel(self, model_name=None):
+        return _SimulatedModel(self, model_name)
+
+
+def _summarize(samples):
+    ordered = sorted(samples)
+    p95_index = min(len(ordered) - 1, int(math.ceil(0.95 * len(ordered))) - 1)
+    return {
+        'n': len(ordered),
+        'min': ordered[0],
+        'median': statistics.median(ordered),
+        'mean': statistics.fmean(ordered),
+        'p95': ordered[p95_index],
+        'max': ordered[-1]
+    }
+
+
+def _timed(func, *args, **kwargs):
+    inicio = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - inicio
+
+
+def generate_fixture(path, seconds):
+    """Genera un WAV con un tono de la duración indicada."""
+    total = int(RATE * seconds)
+    samples = (int(8000 * math.sin(2 * math.pi * 440 * i / RATE)) for i in range(total))
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(CHANNELS)
+        wf.setsampwidth(SAMPLE_WIDTH)
+        wf.setframerate(RATE)
+        wf.writeframes(b''.join(struct.pack('<h', s) for s in samples))
+    return path
+
+
+class _FixtureStream:
+    """Sustituto del stream de PyAudio que entrega un WAV y detiene la grabación al acabar."""
+
+    def __init__(self, source, job):
+        self.source = source
+        self.job = job
+
+    def read(self, chunk, exception_on_overflow=True):
+        data = self.source.readframes(chunk)
+        if self.source.tell() >= self.source.getnframes():
+            self.job.grabando = False
+        return data
+
+
+def replay_capture(fixture_path):
+    """Reproduce un WAV por la misma captura y escritura que usa grabar_audio."""
+    job = SimpleNamespace(frames=[], grabando=True)
+    with wave.open(fixture_path, 'rb') as source:
+        capture_frames(_FixtureStream(source, job), job, CHUNK)
+        return save_wav(job.frames, source.getnchannels(), source.getsampwidth(), source.getframerate())
+
+
+def bench_pipeline(fixtures, repetitions, history):
+    """Mide cada etapa del dictado para cada fixture."""
+    enhancer = TextEnhancer("nuevo_config.json")
+    enhancer.set_api_key("benchmark")
+    enhancer.set_enabled(True)
+
+    results = []
+    for fixture in fixtures:
+        stages = {'conexion': [], 'captura': [], 'transcripcion': [], 'mejora': [], 'historial': [], 'total': []}
+        for _ in range(repetitions):
+            # Cada repetición empieza con la conexión fría, como tras un rato sin dictar
+            nuevo_text_enhancer.genai.close_connections()
+            inicio = time.perf_counter()
+            _, t_conexion = _timed(enhancer.warm_up)
+            audio_file, t_captura = _timed(replay_capture, fixture)
+            try:
+                texto, t_transcripcion = _timed(enhancer.transcribe_audio, audio_file)
+                texto_final, t_mejora = _timed(enhancer.enhance_text, texto)
+                _, t_historial = _timed(history.add_transcription, texto_final,
+                                        time.perf_counter() - inicio, True, "gemini_only")
+            finally:
+                os.unlink(audio_file)
+            stages['conexion'].append(t_conexion)
+            stages['captura'].append(t_captura)
+            stages['transcripcion'].append(t_transcripcion)
+            stages['mejora'].append(t_mejora)
+            stages['historial'].append(t_historial)
+            stages['total'].append(time.perf_counter() - inicio)
+
+        with wave.open(fixture, 'rb') as wf:
+            audio_seconds = wf.getnframes() / wf.getframerate()
+        results.append({
+            'fixture': os.path.basename(fixture),
+            'audio_seconds': audio_seconds,
+            'stages': {name: _summarize(samples) for name, samples in stages.items()}
+        })
+    enhancer.close()
+    return results
+
+
+def _write_history(path, size):
+    now = datetime.now()
+    entries = [{
+        'timestamp': (now - timedelta(minutes=7 * i)).isoformat(),
+        'text': f"Transcripción de prueba número {i} con algo de texto para buscar.",
+        'duration': 3.0 + (i % 17) * 0.5,
+        'used_gemini': i % 3 != 0,
+        'mode': "gemini_only"
+    } for i in range(size)]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+
+
+def bench_history(sizes, repetitions):
+    """Mide las operaciones de TranscriptionHistory para cada tamaño de historial.
+
+    En frío cada repetición usa una instancia nueva (sin la caché de entradas
+    ya convertidas); en caliente se repite sobre la misma instancia tras una
+    primera llamada que llena la caché.
+    """
+    results = []
+    for size in sizes:
+        path = f"bench_history_{size}.json"
+        _write_history(path, size)
+        operations = {
+            'add_transcription': lambda history: history.add_transcription("Nueva transcripción", 2.0, True),
+            'get_recent_transcriptions': lambda history: history.get_recent_transcriptions(10),
+            'search_transcriptions': lambda history: history.search_transcriptions("número 42"),
+            'get_statistics': lambda history: history.get_statistics()
+        }
+        cold, warm = {}, {}
+        for name, operation in operations.items():
+            cold[name] = _summarize([
+                _timed(operation, TranscriptionHistory(path, max_entries=size))[1] for _ in range(repetitions)
+            ])
+            history = TranscriptionHistory(path, max_entries=size)
+            operation(history)
+            warm[name] = _summarize([_timed(operation, history)[1] for _ in range(repetitions)])
+        results.append({'entries': size, 'operations': warm, 'cold_operations': cold})
+        os.unlink(path)
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def compare(current, baseline_path):
+    """Imprime la variación de la mediana respecto a un resultado anterior."""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    def medians(report):
+        values = {}
+        for item in report.get('pipeline', []):
+            for stage, summary in item['stages'].items():
+                values[f"pipeline/{item['fixture']}/{stage}"] = summary['median']
+        for item in report.get('history', []):
+            for operation, summary in item['operations'].items():
+                values[f"history/{item['entries']}/{operation}"] = summary['median']
+            for operation, summary in item.get('cold_operations', {}).items():
+                values[f"history/{item['entries']}/frio/{operation}"] = summary['median']
+        return values
+
+    before, after = medians(baseline), medians(current)
+    print(f"Comparando con {baseline_path} ({baseline.get('revision')})")
+    for key in sorted(after):
+        if key in before and before[key] > 0:
+            change = (after[key] - before[key]) / before[key] * 100
+            print(f"  {key}: {before[key] * 1000:.2f} ms -> {after[key] * 1000:.2f} ms ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline de dictado de LabFlow")
+    parser.add_argument('--fixtures', nargs='*', default=[],
+                        help="Ficheros WAV o directorios con WAV a reproducir (por defecto se generan tonos)")
+    parser.add_argument('--repeticiones', type=int, default=5)
+    parser.add_argument('--tamanos-historial', type=int, nargs='*', default=HISTORY_SIZES)
+    parser.add_argument('--latencia-transcripcion', type=float, default=0.8,
+                        help="Segundos que tarda el modelo simulado en transcribir")
+    parser.add_argument('--latencia-mejora', type=float, default=0.4,
+                        help="Segundos que tarda el modelo simulado en mejorar el texto")
+    parser.add_argument('--latencia-conexion', type=float, default=0.15,
+                        help="Segundos de establecer una conexión nueva (DNS + TLS)")
+    parser.add_argument('--ancho-banda', type=float, default=2_000_000,
+                        help="Bytes por segundo de subida simulados")
+    parser.add_argument('--salida', default="bench_output.json")
+    parser.add_argument('--comparar', help="JSON de una ejecución anterior para comparar")
+    args = parser.parse_args()
+
+    fixtures = []
+    for path in args.fixtures:
+        path = os.path.abspath(path)
+        if os.path.isdir(path):
+            fixtures.extend(sorted(os.path.join(path, n) for n in os.listdir(path) if n.lower().endswith('.wav')))
+        else:
+            fixtures.append(path)
+    salida = os.path.abspath(args.salida)
+    comparar = os.path.abspath(args.comparar) if args.comparar else None
+
+    nuevo_text_enhancer.genai = SimulatedGenAI(
+        args.ancho_banda, args.latencia_transcripcion, args.latencia_mejora, args.latencia_conexion
+    )
+
+    original_dir = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="labflow_bench_") as workdir:
+        # TextEnhancer y TranscriptionHistory escriben en el directorio actual
+        os.chdir(workdir)
+        try:
+            if not fixtures:
+                fixtures = [generate_fixture(os.path.join(workdir, f"tono_{s}s.wav"), s) for s in (2, 10, 30)]
+            history = TranscriptionHistory("bench_pipeline_history.json")
+            report = {
+                'revision': _git_revision(),
+                'created': datetime.now().isoformat(),
+                'python': sys.version.split()[0],
+                'platform': platform.platform(),
+                'parameters': {
+                    'repetitions': args.repeticiones,
+                    'transcribe_latency': args.latencia_transcripcion,
+                    'enhance_latency': args.latencia_mejora,
+                    'connect_latency': args.latencia_conexion,
+                    'upload_bandwidth': args.ancho_banda
+                },
+                'pipeline': bench_pipeline(fixtures, args.repeticiones, history),
+                'history': bench_history(args.tamanos_historial, args.repeticiones)
+            }
+        finally:
+            os.chdir(original_dir)
+
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Resultados guardados en {salida}")
+
+    if comparar:
+        compare(report, comparar)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import os
+import json
+import tempfile
+import threading
+import logging
+from typing import Callable, Dict, Optional
+
+class ConfigService:
+    """Mantiene la configuración en memoria y la persiste de forma diferida y atómica."""
+
+    def __init__(self, config_file: str = "nuevo_config.json", debounce: float = 0.5, watch_interval: float = 2.0):
+        self.config_file = config_file
+        self.debounce = debounce
+        self.watch_interval = watch_interval
+        self._data: Dict = {}
+        # Claves modificadas en memoria que todavía no se han escrito en disco
+        self._dirty: Dict = {}
+        self._lock = threading.RLock()
+        self._save_timer: Optional[threading.Timer] = None
+        self._last_stat = None
+        self._listeners = []
+        self._stop_event = threading.Event()
+        self.exists = False
+        self._load()
+        self._watcher = threading.Thread(target=self._watch, name="config-watcher", daemon=True)
+        self._watcher.start()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.config_file)
+            return (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _load(self):
+        """Lee el archivo de configuración a memoria al arrancar."""
+        with self._lock:
+            self._last_stat = self._stat()
+            self.exists = self._last_stat is not None
+            if not self.exists:
+                self._data = {}
+                return
+            try:
+                self._data = self._read()
+            except json.JSONDecodeError:
+                # Conservar el archivo dañado para poder recuperarlo a mano
+                backup = self.config_file + ".corrupto"
+                logging.error(f"Error al decodificar JSON de {self.config_file}. Copia guardada en {backup}.")
+                try:
+                    os.replace(self.config_file, backup)
+                except Exception as e:
+                    logging.error(f"No se pudo respaldar la configuración dañada: {e}")
+                self._data = {}
+                self._last_stat = None
+                self.exists = False
+            except Exception as e:
+                logging.error(f"Error al cargar la configuración: {e}")
+                self._data = {}
+
+    def _read(self) -> Dict:
+        with open(self.config_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+
+    def _reload(self) -> bool:
+        """Relee el archivo tras una edición externa. Devuelve False si no se pudo leer.
+
+        Una edición a medio guardar o con errores no sustituye la configuración en memoria
+        ni mueve el archivo del usuario; se vuelve a intentar cuando cambie de nuevo.
+        """
+        self._last_stat = self._stat()
+        try:
+            data = self._read()
+        except Exception as e:
+            logging.error(f"No se pudo recargar {self.config_file}; se mantiene la configuración actual: {e}")
+            return False
+        # Los cambios en memoria aún sin guardar se conservan sobre la edición externa
+        data.update(self._dirty)
+        self._data = data
+        self.exists = True
+        return True
+
+    def get(self, key: str, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return dict(self._data)
+
+    def update(self, values: Dict):
+        """Actualiza valores en memoria y programa una escritura diferida."""
+        with self._lock:
+            if all(self._data.get(k) == v for k, v in values.items()) and self.exists:
+                return
+            self._data.update(values)
+            self._dirty.update(values)
+            self._schedule_save()
+
+    def _schedule_save(self):
+        # Varias modificaciones seguidas se agrupan en una sola escritura
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+        self._save_timer = threading.Timer(self.debounce, self.flush)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def flush(self):
+        """Escribe la configuración en disco de inmediato (temporal + rename)."""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+            directory = os.path.dirname(os.path.abspath(self.config_file))
+            temp_path = None
+            try:
+                fd, temp_path = tempfile.mkstemp(prefix=".config-", suffix=".tmp", dir=directory)
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(self._data, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.config_file)
+                self._dirty = {}
+                self._last_stat = self._stat()
+                self.exists = True
+            except Exception as e:
+                logging.error(f"Error al guardar la configuración: {e}")
+                if temp_path and os.path.exists(temp_path):
+                    try:
+                        os.unlink(temp_path)
+                    except OSError:
+                        pass
+
+    def add_listener(self, callback: Callable[[Dict], None]):
+        """Registra una función que recibe la configuración tras una edición externa.
+
+        Se invoca desde el hilo vigilante, no desde el hilo de Tk.
+        """
+        self._listeners.append(callback)
+
+    def _watch(self):
+        while not self._stop_event.wait(self.watch_interval):
+            with self._lock:
+                current = self._stat()
+                if current is None or current == self._last_stat:
+                    continue
+                logging.info(f"Detectado cambio externo en {self.config_file}. Recargando configuración.")
+                if not self._reload():
+                    continue
+                data = dict(self._data)
+            for callback in list(self._listeners):
+                try:
+                    callback(data)
+                except Exception as e:
+                    logging.error(f"Error al aplicar la configuración recargada: {e}")
+
+    def close(self):
+        """Guarda los cambios pendientes y detiene el vigilante."""
+        self._stop_event.set()
+        with self._lock:
+            pending = self._save_timer is not None
+        if pending:
+            self.flush()
@@ -1,57 +1,104 @@
 import keyboard
 import pyaudio
-import wave
-import tempfile
 import os
 import pyperclip
 from pynput.mouse import Controller
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
-from tkinter import ttk
+from tkinter import ttk, filedialog
 import sys
 import re
 from nuevo_transcription_history import TranscriptionHistory
 from nuevo_text_enhancer import TextEnhancer
+from nuevo_profiling import DictationProfiler
+from nuevo_spool import TranscriptionSpool
+from nuevo_audio import capture_frames, save_wav
 from datetime import datetime, timedelta
 import json
 import customtkinter as ctk
 import logging
+import logging.handlers
+import queue
+import atexit
 import webbrowser
 import traceback
 
-# Configurar el sistema de logging
-def setup_logging():
-    # Obtener la ruta del directorio de la aplicación
+# Rotación del archivo de log
+LOG_MAX_BYTES = 5 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+
+# Listener que escribe los registros en segundo plano
+log_listener = None
+
+def get_log_level(config_file="nuevo_config.json"):
+    """Lee el nivel de logging de la configuración (INFO por defecto)."""
+    level_name = "INFO"
+    try:
+        if os.path.exists(config_file):
+            with open(config_file, 'r', encoding='utf-8') as f:
+                level_name = str(json.load(f).get('log_level', level_name)).upper()
+    except Exception as e:
+        print(f"No se pudo leer el nivel de log de {config_file}: {e}", file=sys.stderr)
+    level = logging.getLevelName(level_name)
+    return level if isinstance(level, int) else logging.INFO
+
+def get_app_dir():
+    """Obtiene la ruta del directorio de la aplicación."""
     if getattr(sys, 'frozen', False):
         # Si estamos en un ejecutable
-        app_dir = os.path.dirname(sys.executable)
-    else:
-        # Si estamos en desarrollo
-        app_dir = os.path.dirname(os.path.abspath(__file__))
+        return os.path.dirname(sys.executable)
+    # Si estamos en desarrollo
+    return os.path.dirname(os.path.abspath(__file__))
+
+def get_log_dir():
+    return os.path.join(get_app_dir(), 'logs')
+
+# Configurar el sistema de logging
+def setup_logging():
+    global log_listener
+
+    app_dir = get_app_dir()
     
     # Crear directorio de logs si no existe
-    log_dir = os.path.join(app_dir, 'logs')
+    log_dir = get_log_dir()
     os.makedirs(log_dir, exist_ok=True)
     
     # Configurar el archivo de log
     log_file = os.path.join(log_dir, 'wisprflow_soft_nuevo.log')
+    level = get_log_level()
     
     # Configurar el formato del logging
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file, encoding='utf-8'),
-            logging.StreamHandler()  # También mostrar en consola
-        ]
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+    )
+    stream_handler = logging.StreamHandler()  # También mostrar en consola
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+    
+    # Los hilos de captura y de Tk solo encolan; la E/S la hace el listener
+    log_queue = queue.SimpleQueue()
+    logging.basicConfig(level=level, handlers=[logging.handlers.QueueHandler(log_queue)])
+    log_listener = logging.handlers.QueueListener(
+        log_queue, file_handler, stream_handler, respect_handler_level=True
     )
+    log_listener.start()
+    atexit.register(stop_logging)
     
     # Log inicial
     logging.info('Iniciando WisprFlow Soft (Nuevo Script)')
     logging.info(f'Directorio de la aplicación: {app_dir}')
     logging.info(f'Archivo de log: {log_file}')
 
+def stop_logging():
+    """Vacía la cola de logging y detiene el listener."""
+    global log_listener
+    if log_listener is not None:
+        log_listener.stop()
+        log_listener = None
+
 # Configurar el manejador de excepciones global
 def handle_exception(exc_type, exc_value, exc_traceback):
     if issubclass(exc_type, KeyboardInterrupt):
@@ -72,6 +119,20 @@ FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 44100
 
+# Número de dictados que se transcriben en paralelo
+PROCESSING_WORKERS = 2
+
+class DictationJob:
+    """Un dictado independiente: su audio, su estado de grabación y su orden de pegado."""
+    def __init__(self, seq):
+        self.seq = seq
+        self.frames = []
+        self.grabando = True
+        self.tiempo_inicio = time.time()
+        self.audio_file = None
+        # Segundos por etapa (conexión, transcripción, mejora) que se guardan en el historial
+        self.timings = {}
+
 class SettingsWindow(ctk.CTkToplevel):
     def __init__(self, parent, history, text_enhancer, app):
         super().__init__(parent)
@@ -130,12 +191,17 @@ class SettingsWindow(ctk.CTkToplevel):
         except (AttributeError, KeyError) as e:
             logging.warning(f"Could not apply custom color to 'Donar' tab: {e}")
         
-        self.setup_api_tab()
-        self.setup_history_tab()
-        self.setup_stats_tab()
-        self.setup_config_tab()
-        self.setup_model_tab()
-        self.setup_donate_tab()
+        # Las pestañas se construyen la primera vez que se seleccionan
+        self._tab_builders = {
+            "API": self.setup_api_tab,
+            "Historial": self.setup_history_tab,
+            "Estadísticas": self.setup_stats_tab,
+            "Configuración": self.setup_config_tab,
+            "Modelo Gemini": self.setup_model_tab,
+            "Donar": self.setup_donate_tab
+        }
+        self._built_tabs = set()
+        self._build_tab(self.tabview.get())
         
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.transient(parent)
@@ -146,8 +212,38 @@ class SettingsWindow(ctk.CTkToplevel):
         self.lift()
         self.focus_force()
 
+    def _build_tab(self, name):
+        if name in self._built_tabs or name not in self._tab_builders:
+            return
+        self._built_tabs.add(name)
+        self._tab_builders[name]()
+
+    def _load_in_background(self, loader, on_loaded):
+        """Ejecuta loader en un hilo de trabajo y entrega el resultado en el bucle de Tk."""
+        def worker():
+            try:
+                result = loader()
+            except Exception as e:
+                logging.error(f"Error al cargar datos en segundo plano: {e}")
+                result = None
+            try:
+                self.after(0, self._deliver_loaded, on_loaded, result)
+            except Exception as e:
+                # La ventana se cerró antes de terminar la carga
+                logging.debug(f"Resultado descartado, ventana cerrada: {e}")
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _deliver_loaded(self, on_loaded, result):
+        if not self.winfo_exists():
+            return
+        try:
+            on_loaded(result)
+        except Exception as e:
+            logging.error(f"Error al mostrar datos cargados: {e}")
+
     def on_tab_change(self):
         selected_tab = self.tabview.get()
+        self._build_tab(selected_tab)
         
         # Un color amarillo/dorado que resalta
         donate_color = "#FFD700"  # Gold, for when selected
@@ -204,7 +300,49 @@ class SettingsWindow(ctk.CTkToplevel):
         frame = ctk.CTkScrollableFrame(tab)
         frame.pack(fill="both", expand=True, padx=10, pady=10)
         
-        history_entries = self.history.get_recent_transcriptions(10)
+        placeholder = ctk.CTkLabel(frame, text="Cargando historial...")
+        placeholder.pack(pady=10)
+        
+        self._load_in_background(
+            lambda: self.history.get_recent_transcriptions(10),
+            lambda entries: self._populate_history_tab(frame, placeholder, entries)
+        )
+        
+        buttons_frame = ctk.CTkFrame(tab, fg_color="transparent")
+        buttons_frame.pack(pady=(0, 10))
+        
+        status_label = ctk.CTkLabel(tab, text="")
+        status_label.pack(pady=(0, 10))
+        
+        file_types = [("JSON Lines", "*.jsonl"), ("CSV", "*.csv")]
+        
+        def export_history():
+            path = filedialog.asksaveasfilename(parent=self, defaultextension=".jsonl", filetypes=file_types)
+            if not path:
+                return
+            status_label.configure(text="Exportando...")
+            self._load_in_background(
+                lambda: self.history.export_history(path),
+                lambda count: status_label.configure(
+                    text=f"Exportadas {count} transcripciones." if count is not None else "Error al exportar el historial.")
+            )
+        
+        def import_history():
+            path = filedialog.askopenfilename(parent=self, filetypes=file_types)
+            if not path:
+                return
+            status_label.configure(text="Importando...")
+            self._load_in_background(
+                lambda: self.history.import_history(path),
+                lambda count: status_label.configure(
+                    text=f"Importadas {count} transcripciones nuevas." if count is not None else "Error al importar el historial.")
+            )
+        
+        ctk.CTkButton(buttons_frame, text="Exportar historial", command=export_history).pack(side="left", padx=5)
+        ctk.CTkButton(buttons_frame, text="Importar historial", command=import_history).pack(side="left", padx=5)
+
+    def _populate_history_tab(self, frame, placeholder, history_entries):
+        placeholder.destroy()
         
         if not history_entries:
             ctk.CTkLabel(frame, text="No hay transcripciones en el historial.").pack(pady=10)
@@ -249,10 +387,23 @@ class SettingsWindow(ctk.CTkToplevel):
         title = ctk.CTkLabel(tab, text="Estadísticas de Uso", font=ctk.CTkFont(size=16, weight="bold"))
         title.pack(pady=(10, 20))
         
-        stats = self.history.get_statistics()
         frame = ctk.CTkScrollableFrame(tab)
         frame.pack(fill="both", expand=True, padx=10, pady=10)
         
+        placeholder = ctk.CTkLabel(frame, text="Calculando estadísticas...")
+        placeholder.pack(pady=10)
+        
+        self._load_in_background(
+            self.history.get_statistics,
+            lambda stats: self._populate_stats_tab(frame, placeholder, stats)
+        )
+
+    def _populate_stats_tab(self, frame, placeholder, stats):
+        placeholder.destroy()
+        if not stats:
+            ctk.CTkLabel(frame, text="No se pudieron cargar las estadísticas.").pack(pady=10)
+            return
+        
         def create_stat_section(title, data):
             section = ctk.CTkFrame(frame)
             section.pack(fill="x", pady=5, padx=5)
@@ -267,6 +418,17 @@ class SettingsWindow(ctk.CTkToplevel):
         create_stat_section("Última semana", {"Total transcripciones": stats['last_week']['total'], "Con mejoras": stats['last_week']['gemini']})
         create_stat_section("Último mes", {"Total transcripciones": stats['last_month']['total'], "Con mejoras": stats['last_month']['gemini']})
         create_stat_section("Totales", {"Peticiones a Gemini": stats['total_gemini_requests'], "Duración promedio": f"{stats['avg_duration']:.2f}s"})
+        
+        def usage_summary(usage):
+            return (f"{usage['requests']} peticiones · {usage['total_tokens']} tokens "
+                    f"(entrada {usage['prompt_tokens']}, audio {usage['audio_tokens']}, salida {usage['output_tokens']}) · "
+                    f"{usage['request_bytes'] / 1024:.0f} KB enviados / {usage['response_bytes'] / 1024:.1f} KB recibidos")
+        
+        if stats.get('usage_by_model'):
+            create_stat_section("Consumo por modelo", {model: usage_summary(usage) for model, usage in sorted(stats['usage_by_model'].items())})
+        if stats.get('usage_by_day'):
+            recent_days = sorted(stats['usage_by_day'].items(), reverse=True)[:7]
+            create_stat_section("Consumo por día (últimos 7 días con uso)", {day: usage_summary(usage) for day, usage in recent_days})
 
     def setup_config_tab(self):
         tab = self.tabview.tab("Configuración")
@@ -386,6 +548,7 @@ class WisprApp:
             command=self.toggle_text_enhancer
         )
         self.enhancer_check.pack(side='left', padx=2)
+        self.text_enhancer.config.add_listener(lambda config: self.root.after(0, self._sync_enhancer_check))
         
         self.status_label = ctk.CTkLabel(
             self.status_frame, text="•", font=("Arial", 20),
@@ -399,16 +562,39 @@ class WisprApp:
         )
         self.mode_label.pack(side='right', padx=5)
         
-        self.grabando = False
-        self.frames = []
+        # Dictados: uno grabando como máximo, varios en cola de procesamiento
+        self.job_actual = None
+        self._jobs_lock = threading.Lock()
+        self._siguiente_seq = 0
+        self._siguiente_pegado = 0
+        self._resultados = {}
+        self._jobs_pendientes = 0
+        self.executor = ThreadPoolExecutor(max_workers=PROCESSING_WORKERS, thread_name_prefix="dictado")
         self.ultima_pulsacion = 0
         self.DEBOUNCE_TIME = 0.5
         self.animacion_activa = False
         self.estado_actual = "inactivo"
+        self._animacion_id = None
+        self._ultimo_frame = None
+        
+        # Perfilado opcional de cada dictado (menú contextual o 'profiling_enabled' en la config)
+        self.profiler = DictationProfiler(get_log_dir())
+        self.profiling_enabled = ctk.BooleanVar(value=bool(self.text_enhancer.config.get('profiling_enabled', False)))
+        self._profiling_activo = self.profiling_enabled.get()
+        
+        # Dictados fallidos u offline: se guardan y se reintentan en segundo plano
+        self.spool = TranscriptionSpool(
+            os.path.join(get_app_dir(), 'spool'), self.text_enhancer, self.history,
+            on_result=lambda texto, meta: self.root.after(0, self.show_notification,
+                                                         "Dictado pendiente transcrito:", texto),
+            on_failed=lambda meta: self.root.after(0, self.show_notification,
+                                                   f"No se pudo transcribir un dictado tras {meta['attempts']} "
+                                                   f"intentos. El audio se conserva en spool/fallidos.")
+        )
+        self.spool.start()
         
         keyboard.add_hotkey('ctrl+less', self.toggle_grabacion)
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
-        self.animar_puntos()
         self.setup_context_menu()
         self.settings_window = None
 
@@ -431,48 +617,77 @@ class WisprApp:
     def toggle_text_enhancer(self):
         self.text_enhancer.set_enabled(self.use_enhancer.get())
 
+    def _sync_enhancer_check(self):
+        # Refleja en el checkbox una edición externa de la configuración
+        if self.use_enhancer.get() != self.text_enhancer.enabled:
+            self.use_enhancer.set(self.text_enhancer.enabled)
+
     def animar_puntos(self):
+        self._animacion_id = None
+        if not self.animacion_activa:
+            return
         if not hasattr(self, 'root') or not self.root.winfo_exists():
             return
         try:
-            if self.animacion_activa:
-                if self.estado_actual == "grabando":
-                    puntos = "•" * (int(time.time() * 2) % 4)
-                    self.status_label.configure(text=puntos, text_color='#FF0000')
-                elif self.estado_actual == "transcribiendo":
-                    puntos = "•" * (int(time.time() * 1.5) % 4)
-                    self.status_label.configure(text=puntos, text_color='#FFD700')
+            if self.estado_actual == "grabando":
+                puntos = "•" * (int(time.time() * 2) % 4)
+                color = '#FF0000'
             else:
-                self.status_label.configure(text="•", text_color='#FFFFFF')
-            if self.root.winfo_exists():
-                self.root.after(100, self.animar_puntos)
+                puntos = "•" * (int(time.time() * 1.5) % 4)
+                color = '#FFD700'
+            # Solo reconfigurar la etiqueta cuando el texto cambia realmente
+            if (puntos, color) != self._ultimo_frame:
+                self.status_label.configure(text=puntos, text_color=color)
+                self._ultimo_frame = (puntos, color)
+            self._animacion_id = self.root.after(100, self.animar_puntos)
         except Exception as e:
             logging.warning(f"Error en animar_puntos: {e}")
 
+    def _detener_animacion(self):
+        if self._animacion_id is not None:
+            try:
+                self.root.after_cancel(self._animacion_id)
+            except Exception as e:
+                logging.warning(f"Error al cancelar la animación: {e}")
+            self._animacion_id = None
+        self._ultimo_frame = None
+
     def actualizar_estado(self, estado, activar_animacion=True):
+        # Se llama también desde el hilo de grabación y desde el hilo del
+        # hotkey; los cambios de la interfaz se aplican siempre en el bucle de Tk.
+        if threading.current_thread() is threading.main_thread():
+            self._aplicar_estado(estado, activar_animacion)
+        else:
+            try:
+                self.root.after(0, self._aplicar_estado, estado, activar_animacion)
+            except Exception as e:
+                logging.warning(f"Error en actualizar_estado: {e}")
+
+    def _aplicar_estado(self, estado, activar_animacion):
         if not hasattr(self, 'root') or not self.root.winfo_exists():
             return
         try:
-            self.animacion_activa = activar_animacion
             self.estado_actual = estado
-            if not activar_animacion:
+            # El temporizador de animación solo existe mientras se graba o transcribe
+            self.animacion_activa = activar_animacion and estado in ("grabando", "transcribiendo")
+            if self.animacion_activa:
+                if self._animacion_id is None:
+                    self.animar_puntos()
+            else:
+                self._detener_animacion()
                 self.status_label.configure(text="•", text_color='#FFFFFF')
         except Exception as e:
             logging.warning(f"Error en actualizar_estado: {e}")
 
-    def grabar_audio(self):
-        logging.info("Iniciando grabación de audio")
+    def grabar_audio(self, job):
+        logging.info(f"Iniciando grabación de audio (dictado #{job.seq})")
         p = pyaudio.PyAudio()
         stream = None
         try:
             stream = p.open(format=FORMAT, channels=CHANNELS, rate=RATE,
                           input=True, frames_per_buffer=CHUNK)
-            self.actualizar_estado("grabando", True)
-            self.frames = []
             logging.info("Iniciando captura de frames de audio")
-            while self.grabando:
-                data = stream.read(CHUNK, exception_on_overflow=False)
-                self.frames.append(data)
+            capture_frames(stream, job, CHUNK)
         except Exception as e:
             logging.error(f"Error durante la grabación: {e}")
             return None
@@ -483,29 +698,25 @@ class WisprApp:
             p.terminate()
             logging.info("Recursos de PyAudio liberados.")
         
-        if not self.frames:
+        if not job.frames:
             logging.warning("No se capturaron frames de audio.")
             return None
         
         try:
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
-                wf = wave.open(temp_file.name, 'wb')
-                wf.setnchannels(CHANNELS)
-                wf.setsampwidth(p.get_sample_size(FORMAT))
-                wf.setframerate(RATE)
-                wf.writeframes(b''.join(self.frames))
-                wf.close()
-                logging.info(f"Audio guardado en: {temp_file.name}")
-                return temp_file.name
+            audio_file = save_wav(job.frames, CHANNELS, p.get_sample_size(FORMAT), RATE)
+            logging.info(f"Audio guardado en: {audio_file}")
+            return audio_file
         except Exception as e:
             logging.error(f"Error al guardar archivo WAV: {e}")
             return None
+        finally:
+            # Los frames ya están en el WAV; no retenerlos mientras el job espera en la cola
+            job.frames = []
 
     def pegar_texto(self, texto):
         if texto:
             pyperclip.copy(texto)
             keyboard.send('ctrl+v')
-            self.actualizar_estado("inactivo", False)
 
     def toggle_grabacion(self):
         tiempo_actual = time.time()
@@ -513,60 +724,189 @@ class WisprApp:
             return
         self.ultima_pulsacion = tiempo_actual
         
-        if not self.grabando:
-            logging.info("Iniciando grabación...")
-            self.grabando = True
-            threading.Thread(target=self.procesar_grabacion, daemon=True).start()
+        if self.job_actual is None:
+            with self._jobs_lock:
+                job = DictationJob(self._siguiente_seq)
+                self._siguiente_seq += 1
+                self.job_actual = job
+            logging.info(f"Iniciando grabación (dictado #{job.seq})...")
+            threading.Thread(target=self.capturar_grabacion, args=(job,), daemon=True).start()
+            # Abrir la conexión con la API mientras el usuario todavía habla
+            threading.Thread(target=self.precalentar_conexion, args=(job,), daemon=True).start()
         else:
-            logging.info("Deteniendo grabación...")
-            self.grabando = False
-            self.actualizar_estado("transcribiendo", True)
+            job = self.job_actual
+            logging.info(f"Deteniendo grabación (dictado #{job.seq})...")
+            self._detener_job(job)
+        self.root.after(0, self._actualizar_indicador)
 
-    def procesar_grabacion(self):
+    def _detener_job(self, job):
+        """Termina la grabación de un job y lo cuenta como pendiente de pegar (una sola vez)."""
+        with self._jobs_lock:
+            if self.job_actual is job:
+                self.job_actual = None
+                self._jobs_pendientes += 1
+        job.grabando = False
+
+    def precalentar_conexion(self, job):
+        elapsed = self.text_enhancer.warm_up()
+        if elapsed is not None:
+            job.timings['conexion'] = elapsed
+
+    def capturar_grabacion(self, job):
+        """Graba el audio de un dictado y lo entrega a la cola de procesamiento."""
         if not self.text_enhancer.is_configured:
             logging.error("API de Gemini no configurada. Abortando transcripción.")
             self.root.after(0, self.show_api_warning_window)
-            self.actualizar_estado("inactivo", False)
+            self._detener_job(job)
+            self._finalizar_job(job, None)
             return
 
-        tiempo_inicio = time.time()
-        audio_file = self.grabar_audio()
-        
+        audio_file = self.grabar_audio(job)
         if audio_file:
+            job.audio_file = audio_file
+            self.executor.submit(self._ejecutar_job, job)
+        else:
+            logging.warning("No se generó archivo de audio para transcribir.")
+            # Si la grabación falló al abrir el micrófono el job sigue siendo el actual
+            self._detener_job(job)
+            self._finalizar_job(job, None)
+
+    def _ejecutar_job(self, job):
+        """Procesa un job en el pool; pase lo que pase, el dictado queda con un resultado."""
+        try:
+            if self._profiling_activo:
+                self.profiler.profile(f"dictado{job.seq}", self.procesar_grabacion, job)
+            else:
+                self.procesar_grabacion(job)
+        except Exception as e:
+            logging.error(f"Error inesperado procesando el dictado #{job.seq}: {e}")
+            self._finalizar_job(job, None)
+
+    def procesar_grabacion(self, job):
+        texto_final = None
+        try:
             texto_final = ""
             used_gemini = False
+            usage = {}
+            en_cola = False
             try:
-                texto_transcrito = self.text_enhancer.transcribe_audio(audio_file)
+                inicio = time.perf_counter()
+                texto_transcrito = self.text_enhancer.transcribe_audio(job.audio_file, usage=usage)
+                job.timings['transcripcion'] = time.perf_counter() - inicio
                 used_gemini = True
                 
                 if self.use_enhancer.get():
                     logging.info("Aplicando mejoras de texto...")
-                    texto_final = self.text_enhancer.enhance_text(texto_transcrito)
+                    inicio = time.perf_counter()
+                    texto_final = self.text_enhancer.enhance_text(texto_transcrito, usage=usage)
+                    job.timings['mejora'] = time.perf_counter() - inicio
                 else:
                     texto_final = texto_transcrito
                     
             except Exception as e:
                 logging.error(f"Error en la transcripción con Gemini: {e}")
-                texto_final = "Error en la transcripción. Verifique su API Key y conexión."
+                meta = {
+                    'duration': time.time() - job.tiempo_inicio,
+                    'recorded_at': datetime.fromtimestamp(job.tiempo_inicio).isoformat(),
+                    'enhance': self.use_enhancer.get(),
+                    'mode': "gemini_only"
+                }
+                if self.spool.add(job.audio_file, meta):
+                    # No se pega nada; el resultado llegará como notificación al reintentar
+                    en_cola = True
+                    texto_final = None
+                    self.root.after(0, self.show_notification,
+                                    "Sin conexión: el dictado se ha guardado y se reintentará automáticamente.")
+                else:
+                    texto_final = "Error en la transcripción. Verifique su API Key y conexión."
             
-            duracion = time.time() - tiempo_inicio
-            self.history.add_transcription(texto_final, duracion, used_gemini, "gemini_only")
-            self.root.after(0, self.pegar_texto, texto_final)
+            duracion = time.time() - job.tiempo_inicio
+            logging.info(f"Tiempos del dictado #{job.seq}: {job.timings}")
+            if not en_cola:
+                self.history.add_transcription(texto_final, duracion, used_gemini, "gemini_only", usage=usage,
+                                               timings=job.timings)
+            if used_gemini:
+                # Hay conexión: reintentar ya los dictados que estuvieran en cola
+                self.spool.kick()
             
             try:
-                os.unlink(audio_file)
-                logging.info(f"Archivo temporal {audio_file} eliminado.")
+                os.unlink(job.audio_file)
+                logging.info(f"Archivo temporal {job.audio_file} eliminado.")
             except Exception as e:
                 logging.error(f"Error al eliminar archivo temporal: {e}")
+        finally:
+            self._finalizar_job(job, texto_final)
+
+    def _finalizar_job(self, job, texto):
+        """Registra el resultado de un dictado; se pega en el orden en que se empezó a grabar."""
+        with self._jobs_lock:
+            if job.seq in self._resultados or job.seq < self._siguiente_pegado:
+                # Ya finalizado (p. ej. el error llegó después del finally de procesar_grabacion)
+                return
+            self._resultados[job.seq] = texto
+        self.root.after(0, self._pegar_en_orden)
+
+    def _pegar_en_orden(self):
+        listos = []
+        with self._jobs_lock:
+            while self._siguiente_pegado in self._resultados:
+                listos.append(self._resultados.pop(self._siguiente_pegado))
+                self._siguiente_pegado += 1
+                self._jobs_pendientes -= 1
+        for texto in listos:
+            self.pegar_texto(texto)
+        self._actualizar_indicador()
+
+    def _actualizar_indicador(self):
+        """Refleja en el widget la grabación en curso y los dictados en cola."""
+        with self._jobs_lock:
+            pendientes = self._jobs_pendientes
+        if self.job_actual is not None:
+            self.actualizar_estado("grabando", True)
+        elif pendientes:
+            self.actualizar_estado("transcribiendo", True)
         else:
-            logging.warning("No se generó archivo de audio para transcribir.")
-        
-        self.actualizar_estado("inactivo", False)
+            self.actualizar_estado("inactivo", False)
+        try:
+            self.mode_label.configure(text=f"G{pendientes}" if pendientes else "G")
+        except Exception as e:
+            logging.warning(f"Error al actualizar la cola en el widget: {e}")
 
     def show_error_message(self, message):
         from customtkinter.windows.widgets.ctk_messagebox import CTkMessagebox
         CTkMessagebox(title="Error", message=message, icon="cancel")
 
+    def show_notification(self, message, texto=None):
+        """Muestra un aviso temporal junto al widget, con botón de copiar si hay texto."""
+        window = ctk.CTkToplevel(self.root)
+        window.overrideredirect(True)
+        window.attributes('-topmost', True)
+        window.configure(fg_color="#2C2C2C")
+        
+        WIN_WIDTH = 400
+        ctk.CTkLabel(window, text=message, wraplength=WIN_WIDTH - 20, text_color="#FFCC00",
+                     font=("Arial", 10), justify="left").pack(padx=10, pady=(10, 5), fill="x")
+        if texto:
+            preview = texto if len(texto) <= 300 else texto[:300] + "…"
+            ctk.CTkLabel(window, text=preview, wraplength=WIN_WIDTH - 20, text_color="#DCDCAA",
+                         font=("Arial", 10), justify="left").pack(padx=10, pady=5, fill="x")
+        
+        buttons = ctk.CTkFrame(window, fg_color="transparent")
+        buttons.pack(pady=(0, 10))
+        if texto:
+            def copy_text():
+                pyperclip.copy(texto)
+                window.destroy()
+            ctk.CTkButton(buttons, text="Copiar", width=80, command=copy_text).pack(side="left", padx=5)
+        ctk.CTkButton(buttons, text="Cerrar", width=80, command=window.destroy).pack(side="left", padx=5)
+        
+        window.update_idletasks()
+        win_height = window.winfo_height()
+        x = self.root.winfo_x() + (self.root.winfo_width() - WIN_WIDTH) // 2
+        y = self.root.winfo_y() - win_height - 10
+        window.geometry(f'{WIN_WIDTH}x{win_height}+{x}+{y}')
+        window.after(30000 if texto else 8000, lambda: window.winfo_exists() and window.destroy())
+
     def show_api_warning_window(self):
         if hasattr(self, 'api_warning_window') and self.api_warning_window.winfo_exists():
             self.api_warning_window.lift()
@@ -610,30 +950,58 @@ class WisprApp:
     def on_closing(self):
         try:
             logging.info("Cerrando la aplicación...")
-            self.grabando = False
+            if self.job_actual is not None:
+                self.job_actual.grabando = False
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.spool.stop()
             self.animacion_activa = False
+            self._detener_animacion()
             keyboard.remove_hotkey('ctrl+less')
             
             if self.settings_window and self.settings_window.winfo_exists():
                 self.settings_window.destroy()
             
-            self.text_enhancer._save_config()
+            self.text_enhancer.close()
             self.root.quit()
             self.root.destroy()
         except Exception as e:
             logging.error(f"Error durante el cierre: {e}")
         finally:
+            # os._exit no ejecuta atexit: vaciar la cola de logs antes de salir
+            stop_logging()
             os._exit(0)
 
     def setup_context_menu(self):
         self.context_menu = tk.Menu(self.root, tearoff=0)
         self.context_menu.add_command(label="Configuración", command=self.show_settings)
+        self.context_menu.add_checkbutton(label="Perfilar dictados", variable=self.profiling_enabled, command=self.toggle_profiling)
+        self.context_menu.add_command(label="Ver último perfil", command=self.show_profile_summary)
         self.context_menu.add_separator()
         self.context_menu.add_command(label="Salir", command=self.on_closing)
         
         for widget in [self.root, self.main_frame, self.status_frame, self.status_label, self.enhancer_check, self.mode_label]:
             widget.bind("<Button-3>", self.show_context_menu)
 
+    def toggle_profiling(self):
+        self._profiling_activo = self.profiling_enabled.get()
+        self.text_enhancer.config.update({'profiling_enabled': self._profiling_activo})
+        logging.info(f"Perfilado de dictados {'activado' if self._profiling_activo else 'desactivado'}")
+
+    def show_profile_summary(self):
+        """Muestra los puntos calientes y de asignación del último dictado perfilado."""
+        summary = self.profiler.latest_summary()
+        if summary is None:
+            summary = "Todavía no hay perfiles. Activa 'Perfilar dictados' en el menú y haz un dictado."
+        
+        window = ctk.CTkToplevel(self.root)
+        window.title("Wispr Flow Soft - Último perfil")
+        window.geometry("900x600")
+        window.attributes('-topmost', True)
+        textbox = ctk.CTkTextbox(window, font=("Consolas", 11), wrap="none")
+        textbox.pack(fill="both", expand=True, padx=10, pady=10)
+        textbox.insert("1.0", summary)
+        textbox.configure(state="disabled")
+
     def show_context_menu(self, event):
         self.context_menu.post(event.x_root, event.y_root)
 
@@ -0,0 +1,98 @@
+import os
+import io
+import cProfile
+import pstats
+import tracemalloc
+import threading
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+class DictationProfiler:
+    """Captura un perfil de cProfile y de tracemalloc por cada dictado procesado."""
+
+    def __init__(self, output_dir: str, top: int = 20):
+        self.output_dir = output_dir
+        self.top = top
+        self._lock = threading.Lock()
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def _start_tracemalloc(self):
+        """Devuelve la instantánea inicial y si el trazado lo ha arrancado este perfil."""
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(10)
+        else:
+            # Trazado ya activo (p. ej. PYTHONTRACEMALLOC): se reutiliza y no se detiene al terminar
+            tracemalloc.reset_peak()
+        return tracemalloc.take_snapshot(), started_here
+
+    def _stop_tracemalloc(self, started_here: bool):
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_here:
+            tracemalloc.stop()
+        return snapshot, peak
+
+    def profile(self, label: str, func, *args, **kwargs):
+        """Ejecuta func perfilándola y guarda los resultados en output_dir.
+
+        cProfile y tracemalloc son globales al proceso, así que solo se perfila un dictado
+        a la vez; si ya hay uno en curso, func se ejecuta sin perfilar.
+        """
+        if not self._lock.acquire(blocking=False):
+            logging.info(f"Ya hay un dictado perfilándose; {label} se procesa sin perfilar.")
+            return func(*args, **kwargs)
+        try:
+            snapshot_before, started_here = self._start_tracemalloc()
+            profiler = cProfile.Profile()
+            started = datetime.now()
+            try:
+                return profiler.runcall(func, *args, **kwargs)
+            finally:
+                snapshot_after, peak = self._stop_tracemalloc(started_here)
+                try:
+                    self._save(label, started, profiler, snapshot_before, snapshot_after, peak)
+                except Exception as e:
+                    logging.error(f"Error al guardar el perfil del dictado: {e}")
+        finally:
+            self._lock.release()
+
+    def _save(self, label, started, profiler, snapshot_before, snapshot_after, peak):
+        base = os.path.join(self.output_dir, f"profile_{started.strftime('%Y%m%d_%H%M%S')}_{label}")
+        profiler.dump_stats(base + ".prof")
+
+        stream = io.StringIO()
+        stream.write(f"Perfil del dictado {label} - {started.strftime('%d/%m/%Y %H:%M:%S')}\n")
+        stream.write("Nota: cProfile solo mide el hilo del dictado. La subida del audio (hilo gemini-upload)\n"
+                     "y la mejora por fragmentos en paralelo aparecen como una única espera\n"
+                     "(concurrent.futures / threading); la memoria sí incluye todos los hilos.\n\n")
+        stream.write(f"== Funciones con más tiempo acumulado (top {self.top}) ==\n")
+        pstats.Stats(profiler, stream=stream).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+
+        stream.write(f"\n== Memoria retenida al terminar el dictado, por línea (top {self.top}) ==\n")
+        stream.write(f"Pico de memoria trazada durante el dictado: {peak / 1024:.1f} KB\n")
+        filters = [tracemalloc.Filter(False, path) for path in (tracemalloc.__file__, cProfile.__file__, __file__)]
+        diff = snapshot_after.filter_traces(filters).compare_to(snapshot_before.filter_traces(filters), 'lineno')
+        for stat in diff[:self.top]:
+            stream.write(f"{stat}\n")
+
+        with open(base + ".txt", 'w', encoding='utf-8') as f:
+            f.write(stream.getvalue())
+        logging.info(f"Perfil del dictado guardado en {base}.prof / .txt")
+
+    def summaries(self, limit: int = 10) -> List[str]:
+        """Rutas de los resúmenes más recientes, del más nuevo al más antiguo."""
+        try:
+            names = [n for n in os.listdir(self.output_dir) if n.startswith("profile_") and n.endswith(".txt")]
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.output_dir, n) for n in sorted(names, reverse=True)[:limit]]
+
+    def latest_summary(self) -> Optional[str]:
+        """Texto del resumen más reciente, o None si todavía no hay perfiles."""
+        paths = self.summaries(1)
+        if not paths:
+            return None
+        with open(paths[0], 'r', encoding='utf-8') as f:
+            return f.read()
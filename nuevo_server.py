@@ -0,0 +1,286 @@
+"""Modo servidor sin interfaz: expone la transcripción por HTTP en localhost.
+
+Permite que scripts y editores reutilicen el mismo proceso (API configurada,
+modelo y cachés) en lugar de pasar por el hotkey y el widget:
+
+    python nuevo_server.py --port 8765 --workers 2
+
+Cada petición debe llevar el token de nuevo_server_token (se crea junto a
+nuevo_config.json la primera vez, legible solo por el usuario):
+
+    TOKEN=$(cat nuevo_server_token)
+    curl --data-binary @audio.wav -H "Authorization: Bearer $TOKEN" "http://127.0.0.1:8765/transcribe?enhance=1"
+    curl -d '{"text": "hola que tal"}' -H "Authorization: Bearer $TOKEN" http://127.0.0.1:8765/enhance
+    curl -H "Authorization: Bearer $TOKEN" "http://127.0.0.1:8765/history?limit=5"
+
+Las peticiones con un Host distinto de localhost (p. ej. DNS rebinding desde
+una página web) se rechazan aunque lleven token.
+"""
+import argparse
+import hmac
+import json
+import logging
+import os
+import secrets
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from nuevo_text_enhancer import TextEnhancer
+from nuevo_transcription_history import TranscriptionHistory
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+COPY_BUFFER = 64 * 1024
+TOKEN_FILE = "nuevo_server_token"
+LOCAL_HOSTS = {"127.0.0.1", "localhost", "::1"}
+
+def load_token(path):
+    """Lee el token del servidor o lo crea con permisos 0600 si no existe."""
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'r', encoding='utf-8') as f:
+            token = f.read().strip()
+        if not token:
+            raise ValueError(f"El archivo de token {path} está vacío; bórrelo para generar uno nuevo.")
+        return token
+    token = secrets.token_urlsafe(32)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(token + "\n")
+    logging.info(f"Token del servidor creado en {path}")
+    return token
+
+class ServerBusy(Exception):
+    """La cola de trabajos del servidor está llena."""
+
+class DictationService:
+    """Ejecuta transcripciones en un pool acotado compartido por todos los clientes."""
+
+    def __init__(self, text_enhancer, history, workers=2, max_pending=8):
+        self.text_enhancer = text_enhancer
+        self.history = history
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="servidor")
+        # Trabajos en ejecución + en espera; por encima se rechaza con 503
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    def submit(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise ServerBusy()
+        try:
+            future = self.executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def transcribe(self, audio_path, enhance):
+        tiempo_inicio = time.time()
+        usage = {}
+        transcript = self.text_enhancer.transcribe_audio(audio_path, usage=usage)
+        text = self.text_enhancer.enhance_text(transcript, usage=usage) if enhance else transcript
+        duration = time.time() - tiempo_inicio
+        self.history.add_transcription(text, duration, True, "api", usage=usage)
+        return {'text': text, 'transcript': transcript, 'enhanced': enhance, 'duration': duration, 'usage': usage}
+
+    def enhance(self, text):
+        usage = {}
+        return {'text': self.text_enhancer.enhance_text(text, usage=usage), 'usage': usage}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.text_enhancer.close()
+
+class RequestHandler(BaseHTTPRequestHandler):
+    service: DictationService = None
+    token: str = None
+    allowed_hosts = frozenset(LOCAL_HOSTS)
+    server_version = "LabFlow"
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} - {format % args}")
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        """Comprueba Host y token; si no son válidos responde y devuelve False."""
+        host = urlparse("//" + self.headers.get("Host", "")).hostname
+        if host not in self.allowed_hosts:
+            self._send_json(403, {'error': 'Host no permitido'})
+            return False
+        auth = self.headers.get("Authorization", "")
+        scheme, _, supplied = auth.partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(supplied.strip().encode(), self.token.encode()):
+            self._send_json(401, {'error': 'Token no válido o ausente'})
+            return False
+        return True
+
+    def _iter_body(self):
+        """Devuelve el cuerpo por bloques, con Content-Length o en streaming (chunked).
+
+        Lanza ValueError si el cuerpo supera MAX_UPLOAD_BYTES o el chunked está mal formado.
+        """
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            total = 0
+            while True:
+                size = int(self.rfile.readline().split(b";", 1)[0].strip(), 16)
+                if size < 0:
+                    raise ValueError("Tamaño de bloque chunked no válido.")
+                total += size
+                if total > MAX_UPLOAD_BYTES:
+                    raise ValueError("El cuerpo supera el tamaño máximo permitido.")
+                if size == 0:
+                    # Consumir trailers hasta la línea vacía final
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return
+                # Un bloque grande se entrega en trozos de COPY_BUFFER, sin cargarlo entero
+                while size > 0:
+                    data = self.rfile.read(min(COPY_BUFFER, size))
+                    if not data:
+                        raise ValueError("Cuerpo chunked incompleto.")
+                    size -= len(data)
+                    yield data
+                self.rfile.readline()
+        else:
+            remaining = int(self.headers.get("Content-Length", 0))
+            if remaining > MAX_UPLOAD_BYTES:
+                raise ValueError("El cuerpo supera el tamaño máximo permitido.")
+            while remaining > 0:
+                data = self.rfile.read(min(COPY_BUFFER, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                yield data
+
+    def _read_json(self):
+        raw = b"".join(self._iter_body())
+        data = json.loads(raw.decode('utf-8')) if raw else {}
+        if not isinstance(data, dict):
+            raise ValueError("El cuerpo debe ser un objeto JSON.")
+        return data
+
+    def _wait(self, future):
+        try:
+            self._send_json(200, future.result())
+        except Exception as e:
+            logging.error(f"Error procesando petición {self.path}: {e}")
+            self._send_json(500, {'error': str(e)})
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/health":
+            self._send_json(200, {'status': 'ok', 'configured': self.service.text_enhancer.is_configured,
+                                  'model': self.service.text_enhancer.get_model()})
+        elif url.path == "/history":
+            try:
+                limit = int(query.get('limit', ['10'])[0])
+            except ValueError:
+                limit = -1
+            if limit < 0:
+                self._send_json(400, {'error': "El parámetro 'limit' debe ser un entero no negativo."})
+                return
+            self._send_json(200, self.service.history.get_recent_transcriptions(limit))
+        elif url.path == "/search":
+            self._send_json(200, self.service.history.search_transcriptions(query.get('q', [''])[0]))
+        elif url.path == "/statistics":
+            self._send_json(200, self.service.history.get_statistics())
+        else:
+            self._send_json(404, {'error': 'Ruta no encontrada'})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        try:
+            if url.path == "/transcribe":
+                self._handle_transcribe(query)
+            elif url.path == "/enhance":
+                text = self._read_json().get('text', '')
+                self._wait(self.service.submit(self.service.enhance, text))
+            else:
+                self._send_json(404, {'error': 'Ruta no encontrada'})
+        except ServerBusy:
+            self._send_json(503, {'error': 'Servidor ocupado, reintente más tarde'})
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+
+    def _handle_transcribe(self, query):
+        if not self.service.text_enhancer.is_configured:
+            self._send_json(503, {'error': 'API de Gemini no configurada'})
+            return
+        enhance_param = query.get('enhance', [None])[0]
+        enhance = self.service.text_enhancer.enabled if enhance_param is None else enhance_param not in ('0', 'false')
+        suffix = os.path.splitext(query.get('filename', ['audio.wav'])[0])[1] or '.wav'
+
+        # El audio se vuelca a disco por bloques sin cargarlo entero en memoria
+        fd, audio_path = tempfile.mkstemp(suffix=suffix)
+        try:
+            total = 0
+            with os.fdopen(fd, 'wb') as temp_file:
+                for data in self._iter_body():
+                    total += len(data)
+                    temp_file.write(data)
+            if total == 0:
+                raise ValueError("No se recibió audio.")
+            self._wait(self.service.submit(self.service.transcribe, audio_path, enhance))
+        finally:
+            try:
+                os.unlink(audio_path)
+            except Exception as e:
+                logging.error(f"Error al eliminar archivo temporal: {e}")
+
+def run_server(host=DEFAULT_HOST, port=DEFAULT_PORT, workers=2, max_pending=8,
+               config_file="nuevo_config.json", history_file="nuevo_transcription_history.json"):
+    text_enhancer = TextEnhancer(config_file)
+    history = TranscriptionHistory(history_file)
+    token = load_token(os.path.join(os.path.dirname(os.path.abspath(config_file)), TOKEN_FILE))
+    service = DictationService(text_enhancer, history, workers, max_pending)
+
+    # Además de localhost se acepta la dirección de escucha indicada explícitamente
+    allowed_hosts = set(LOCAL_HOSTS)
+    if host not in ("", "0.0.0.0", "::"):
+        allowed_hosts.add(host)
+    if host not in LOCAL_HOSTS:
+        logging.warning(f"El servidor escucha en {host}, fuera de localhost; solo le protege el token.")
+    handler = type("LabFlowHandler", (RequestHandler,),
+                   {'service': service, 'token': token, 'allowed_hosts': frozenset(allowed_hosts)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    logging.info(f"Servidor LabFlow escuchando en http://{host}:{port} ({workers} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logging.info("Deteniendo servidor...")
+    finally:
+        server.server_close()
+        service.shutdown()
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local de transcripción de LabFlow")
+    parser.add_argument('--host', default=DEFAULT_HOST, help="Interfaz de escucha (solo local por defecto)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=2, help="Transcripciones simultáneas")
+    parser.add_argument('--max-pending', type=int, default=8, help="Peticiones en espera antes de responder 503")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    run_server(args.host, args.port, args.workers, args.max_pending)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import wave
+import zlib
+import random
+import tempfile
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+class TranscriptionSpool:
+    """Guarda en disco los dictados que no se pudieron transcribir y los reintenta en segundo plano.
+
+    Cada dictado se guarda como <id>.pcm.z más <id>.json (metadatos). El audio es el PCM
+    original pasado por zlib: sin un códec de voz entre las dependencias, ocupa casi
+    lo mismo que el WAV (unos 5 MB por minuto a 44.1 kHz y 16 bits).
+    Los reintentos usan espera exponencial; cuando la conexión vuelve, la cola se vacía
+    en lotes de batch_size dictados. Tras max_attempts fallos el dictado se aparta a
+    spool_dir/fallidos y se avisa con on_failed.
+    """
+
+    def __init__(self, spool_dir: str, text_enhancer, history,
+                 on_result: Optional[Callable[[str, Dict], None]] = None,
+                 on_failed: Optional[Callable[[Dict], None]] = None,
+                 base_delay: float = 15.0, max_delay: float = 900.0, batch_size: int = 4,
+                 max_attempts: int = 20):
+        self.spool_dir = spool_dir
+        self.failed_dir = os.path.join(spool_dir, "fallidos")
+        self.text_enhancer = text_enhancer
+        self.history = history
+        self.on_result = on_result
+        self.on_failed = on_failed
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._force = False
+        self._thread = None
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+    def _paths(self, item_id: str):
+        base = os.path.join(self.spool_dir, item_id)
+        return base + ".pcm.z", base + ".json"
+
+    @staticmethod
+    def _write_atomic(path: str, data: bytes):
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    def add(self, audio_path: str, metadata: Dict) -> Optional[str]:
+        """Guarda un WAV en la cola. Devuelve el id del dictado o None si no se pudo guardar."""
+        try:
+            with wave.open(audio_path, 'rb') as wf:
+                channels, sample_width, rate = wf.getnchannels(), wf.getsampwidth(), wf.getframerate()
+                frames = wf.readframes(wf.getnframes())
+
+            item_id = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+            audio_spool, meta_spool = self._paths(item_id)
+            meta = dict(metadata)
+            meta.update({
+                'id': item_id,
+                'created': datetime.now().isoformat(),
+                'channels': channels,
+                'sample_width': sample_width,
+                'rate': rate,
+                'attempts': 0,
+                'next_retry': time.time() + self.base_delay
+            })
+            self._write_atomic(audio_spool, zlib.compress(frames, 6))
+            # Los metadatos se escriben al final: un .json sin audio no puede existir
+            self._write_atomic(meta_spool, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+            logging.info(f"Dictado guardado en la cola offline: {item_id} ({len(frames)} bytes de audio)")
+            self._wake.set()
+            return item_id
+        except Exception as e:
+            logging.error(f"No se pudo guardar el dictado en la cola offline: {e}")
+            return None
+
+    def pending(self) -> List[Dict]:
+        """Metadatos de los dictados en cola, del más antiguo al más nuevo."""
+        items = []
+        for name in sorted(os.listdir(self.spool_dir)):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.spool_dir, name), 'r', encoding='utf-8') as f:
+                    items.append(json.load(f))
+            except Exception as e:
+                logging.warning(f"Saltando metadatos ilegibles de la cola offline {name}: {e}")
+        return items
+
+    def kick(self):
+        """Reintenta ya todos los dictados pendientes (p. ej. tras una transcripción correcta)."""
+        with self._lock:
+            self._force = True
+        self._wake.set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="spool-offline", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            items = self.pending()
+            with self._lock:
+                force, self._force = self._force, False
+            now = time.time()
+            due = [item for item in items if force or item.get('next_retry', 0) <= now]
+
+            if due and self.text_enhancer.is_configured:
+                if self._drain(due):
+                    continue
+                items = self.pending()
+
+            # Dormir hasta el siguiente reintento programado (o hasta que llegue trabajo nuevo)
+            if not items:
+                timeout = None
+            elif not self.text_enhancer.is_configured:
+                timeout = self.base_delay
+            else:
+                timeout = max(1.0, min(item.get('next_retry', now) for item in items) - time.time())
+            self._wake.wait(timeout)
+            self._wake.clear()
+
+    def _drain(self, due: List[Dict]) -> bool:
+        """Procesa los dictados vencidos en lotes. Devuelve True si se vació la lista sin fallos."""
+        with ThreadPoolExecutor(max_workers=self.batch_size, thread_name_prefix="spool") as executor:
+            for start in range(0, len(due), self.batch_size):
+                batch = due[start:start + self.batch_size]
+                results = list(executor.map(self._retry, batch))
+                if not all(results):
+                    # Sigue sin haber conexión: esperar al siguiente reintento
+                    return False
+                if self._stop.is_set():
+                    return False
+        return True
+
+    def _give_up(self, meta: Dict):
+        """Aparta un dictado que ha agotado los reintentos; el audio se conserva para revisarlo."""
+        logging.error(f"El dictado {meta['id']} de la cola offline ha fallado {meta['attempts']} veces; "
+                      f"se aparta a {self.failed_dir}: {meta.get('last_error')}")
+        audio_spool, meta_spool = self._paths(meta['id'])
+        try:
+            os.makedirs(self.failed_dir, exist_ok=True)
+            self._write_atomic(os.path.join(self.failed_dir, os.path.basename(meta_spool)),
+                               json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+            # Los metadatos salen de la cola antes que el audio: nunca queda un .json sin audio
+            os.unlink(meta_spool)
+            os.replace(audio_spool, os.path.join(self.failed_dir, os.path.basename(audio_spool)))
+        except Exception as e:
+            logging.error(f"No se pudo apartar el dictado fallido {meta['id']}: {e}")
+            return
+        if self.on_failed:
+            try:
+                self.on_failed(meta)
+            except Exception as e:
+                logging.error(f"Error al notificar un dictado descartado: {e}")
+
+    def _retry(self, meta: Dict) -> bool:
+        audio_spool, meta_spool = self._paths(meta['id'])
+        temp_path = None
+        try:
+            with open(audio_spool, 'rb') as f:
+                frames = zlib.decompress(f.read())
+            with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_file:
+                temp_path = temp_file.name
+                with wave.open(temp_file, 'wb') as wf:
+                    wf.setnchannels(meta['channels'])
+                    wf.setsampwidth(meta['sample_width'])
+                    wf.setframerate(meta['rate'])
+                    wf.writeframes(frames)
+
+            usage = {}
+            text = self.text_enhancer.transcribe_audio(temp_path, usage=usage)
+            if meta.get('enhance', True):
+                text = self.text_enhancer.enhance_text(text, usage=usage)
+        except Exception as e:
+            meta['attempts'] = meta.get('attempts', 0) + 1
+            delay = min(self.max_delay, self.base_delay * 2 ** meta['attempts'])
+            meta['next_retry'] = time.time() + delay * random.uniform(0.8, 1.2)
+            meta['last_error'] = str(e)
+            if meta['attempts'] >= self.max_attempts:
+                self._give_up(meta)
+                return False
+            logging.warning(f"Reintento {meta['attempts']} del dictado {meta['id']} fallido; "
+                            f"siguiente en {delay:.0f}s: {e}")
+            try:
+                self._write_atomic(meta_spool, json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+            except Exception as write_error:
+                logging.error(f"No se pudo actualizar la cola offline: {write_error}")
+            return False
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+        self.history.add_transcription(text, meta.get('duration', 0.0), True, meta.get('mode', "gemini_only"),
+                                       usage=usage, timings={'reintentos': meta.get('attempts', 0) + 1},
+                                       timestamp=meta.get('recorded_at'))
+        for path in (meta_spool, audio_spool):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        logging.info(f"Dictado {meta['id']} de la cola offline transcrito correctamente.")
+        if self.on_result:
+            try:
+                self.on_result(text, meta)
+            except Exception as e:
+                logging.error(f"Error al notificar un dictado recuperado: {e}")
+        return True
@@ -1,10 +1,23 @@
 import os
-import json
 import google.generativeai as genai
-from typing import Optional
+from typing import Dict, Optional
 from datetime import datetime
 import base64
 import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from nuevo_config_service import ConfigService
+
+# Separadores usados para trocear textos largos antes de mejorarlos
+PARAGRAPH_SPLIT = re.compile(r'\n\s*\n')
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?…])\s+')
+
+# Mientras haya habido dictados en los últimos KEEPALIVE_IDLE segundos, se envía una
+# petición mínima cada KEEPALIVE_INTERVAL para que el servidor no cierre la conexión
+KEEPALIVE_INTERVAL = 45
+KEEPALIVE_IDLE = 300
 
 class TextEnhancer:
     def __init__(self, config_file="nuevo_config.json"):
@@ -25,47 +38,84 @@ class TextEnhancer:
         Texto a mejorar:
         """
         self.model = "gemini-2.5-flash-lite-preview-06-17"
+        self.log_level = "INFO"
+        # Mejora por fragmentos de textos largos
+        self.chunk_chars = 4000
+        self.chunk_overlap = 200
+        self.chunk_fanout = 4
+        # Modelos y conexión reutilizados entre dictados
+        self._models = {}
+        self._last_api_activity = 0.0
+        self._warm_lock = threading.Lock()
+        # upload_file usa un cliente HTTP propio por hilo: todas las subidas (y su
+        # precalentamiento) pasan por este hilo para reutilizar la misma conexión
+        self._upload_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gemini-upload")
+        self._keepalive_stop = threading.Event()
+        self._keepalive_thread = None
+        self.config = ConfigService(config_file)
         self._load_config()
+        self.config.add_listener(self._on_config_reloaded)
 
     def _load_config(self):
-        """Carga la configuración desde el archivo."""
+        """Carga la configuración desde el servicio de configuración."""
         try:
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    config = json.load(f)
-                    # Clave de API es la única que se obtiene aquí
-                    self.api_key = config.get('gemini_api_key', None)
-                    self.enabled = config.get('enable_text_enhancement', True)
-                    self.prompt = config.get('prompt', self.default_prompt)
-                    self.model = config.get('gemini_model', self.model)
-                    if self.api_key:
-                        self._configure_api()
-            else:
+            self.api_key = self.config.get('gemini_api_key', None) or None
+            self.enabled = self.config.get('enable_text_enhancement', True)
+            self.prompt = self.config.get('prompt', self.default_prompt)
+            self.model = self.config.get('gemini_model', self.model)
+            self.log_level = self.config.get('log_level', self.log_level)
+            self._load_chunk_settings(self.config.snapshot())
+            if self.api_key:
+                self._configure_api()
+            if not self.config.exists:
                 # Crear archivo de configuración por defecto si no existe
-                self.prompt = self.default_prompt
                 self._save_config()
-        except json.JSONDecodeError:
-            logging.error(f"Error al decodificar JSON de {self.config_file}. Creando uno nuevo.")
-            self.prompt = self.default_prompt
-            self._save_config()
         except Exception as e:
             logging.error(f"Error al cargar la configuración: {e}")
             self.prompt = self.default_prompt
 
+    def _on_config_reloaded(self, config):
+        """Aplica una edición externa de nuevo_config.json."""
+        api_key = config.get('gemini_api_key', None) or None
+        self.enabled = config.get('enable_text_enhancement', self.enabled)
+        self.prompt = config.get('prompt', self.prompt)
+        self.model = config.get('gemini_model', self.model)
+        self.log_level = config.get('log_level', self.log_level)
+        self._load_chunk_settings(config)
+        if api_key != self.api_key:
+            self.api_key = api_key
+            self._configure_api()
+
+    def _load_chunk_settings(self, config):
+        try:
+            self.chunk_chars = max(500, int(config.get('enhance_chunk_chars', self.chunk_chars)))
+            self.chunk_overlap = max(0, int(config.get('enhance_chunk_overlap', self.chunk_overlap)))
+            self.chunk_fanout = max(1, int(config.get('enhance_chunk_fanout', self.chunk_fanout)))
+        except (TypeError, ValueError) as e:
+            logging.warning(f"Valores de fragmentación inválidos en la configuración: {e}")
+
     def _save_config(self):
-        """Guarda la configuración actual en el archivo."""
+        """Guarda la configuración actual (escritura diferida y atómica)."""
         try:
-            config = {
+            self.config.update({
                 'gemini_api_key': self.api_key or '',
                 'enable_text_enhancement': self.enabled,
                 'prompt': self.prompt,
-                'gemini_model': self.model
-            }
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(config, f, indent=4)
+                'gemini_model': self.model,
+                'log_level': self.log_level,
+                'enhance_chunk_chars': self.chunk_chars,
+                'enhance_chunk_overlap': self.chunk_overlap,
+                'enhance_chunk_fanout': self.chunk_fanout
+            })
         except Exception as e:
             logging.error(f"Error al guardar la configuración: {e}")
 
+    def close(self):
+        """Detiene el keep-alive y escribe los cambios de configuración pendientes."""
+        self._keepalive_stop.set()
+        self._upload_executor.shutdown(wait=False, cancel_futures=True)
+        self.config.close()
+
     def _configure_api(self):
         """Configura la API de Gemini con la clave cargada."""
         if not self.api_key:
@@ -73,6 +123,7 @@ class TextEnhancer:
             return
         try:
             genai.configure(api_key=self.api_key)
+            self._models.clear()
             # Verificar que la configuración funciona listando modelos
             genai.list_models()
             self.is_configured = True
@@ -81,19 +132,229 @@ class TextEnhancer:
             logging.error(f"Error al configurar la API de Gemini: {e}")
             self.is_configured = False
 
-    def enhance_text(self, text: str) -> str:
-        """Mejora el texto usando la API de Gemini."""
+    def _record_usage(self, usage: Optional[Dict], kind: str, response, request_bytes: int, response_text: str):
+        """Guarda en usage los tokens y bytes de una petición a Gemini."""
+        if usage is None:
+            return
+        metadata = getattr(response, 'usage_metadata', None)
+        audio_tokens = 0
+        for detail in getattr(metadata, 'prompt_tokens_details', None) or []:
+            if 'AUDIO' in str(getattr(detail, 'modality', '')).upper():
+                audio_tokens += getattr(detail, 'token_count', 0) or 0
+        record = {
+            'model': self.model,
+            'prompt_tokens': getattr(metadata, 'prompt_token_count', 0) or 0,
+            'audio_tokens': audio_tokens,
+            'output_tokens': getattr(metadata, 'candidates_token_count', 0) or 0,
+            'total_tokens': getattr(metadata, 'total_token_count', 0) or 0,
+            'request_bytes': request_bytes,
+            'response_bytes': len(response_text.encode('utf-8'))
+        }
+        usage[kind] = record
+        logging.info(f"Uso de Gemini ({kind}): {record}")
+
+    def enhance_text(self, text: str, usage: Optional[Dict] = None) -> str:
+        """Mejora el texto usando la API de Gemini.
+
+        Los textos más largos que chunk_chars se trocean por párrafos o frases y los
+        fragmentos se mejoran en paralelo (hasta chunk_fanout peticiones a la vez).
+        Si se pasa usage, se rellena usage['enhancement'] con tokens y bytes de la petición.
+        """
         if not self.enabled or not self.is_configured or not text.strip():
             return text
+        chunks = self._split_text(text, self.chunk_chars)
+        if len(chunks) == 1:
+            return self._enhance_chunk(text, usage)
+
+        logging.info(f"Mejorando el texto en {len(chunks)} fragmentos en paralelo")
+        contexts = [None] + [self._overlap_context(chunk) for chunk, _ in chunks[:-1]]
+        chunk_usages = [{} if usage is not None else None for _ in chunks]
+        with ThreadPoolExecutor(max_workers=min(self.chunk_fanout, len(chunks))) as executor:
+            results = list(executor.map(self._enhance_chunk, [chunk for chunk, _ in chunks], chunk_usages, contexts))
+
+        if usage is not None:
+            self._merge_usage(usage, 'enhancement', [u.get('enhancement') for u in chunk_usages if u])
+        merged = [results[0]]
+        for result, (_, separator) in zip(results[1:], chunks[1:]):
+            merged.append(separator)
+            merged.append(result)
+        return "".join(merged)
+
+    def _enhance_chunk(self, text: str, usage: Optional[Dict] = None, context: Optional[str] = None) -> str:
+        """Mejora un texto (o fragmento) con una sola petición; si falla devuelve el original."""
+        if not text.strip():
+            return text
         try:
-            model = genai.GenerativeModel(self.model)
-            response = model.generate_content(self.prompt + text)
+            model = self._get_model()
+            contents = self.prompt + text
+            if context:
+                contents = ("Contexto anterior, solo como referencia (NO lo incluyas en la respuesta):\n"
+                            f"{context}\n\n{contents}")
+            response = model.generate_content(contents)
             enhanced_text = response.text.strip()
+            self._mark_activity()
+            self._record_usage(usage, 'enhancement', response, len(contents.encode('utf-8')), response.text)
             return enhanced_text if enhanced_text else text
         except Exception as e:
             logging.error(f"Error al mejorar el texto: {e}")
             return text
 
+    def _overlap_context(self, chunk: str) -> str:
+        """Final del fragmento anterior, cortado en un límite de palabra."""
+        if self.chunk_overlap <= 0:
+            return ""
+        tail = chunk[-self.chunk_overlap:]
+        if len(chunk) > self.chunk_overlap and " " in tail:
+            tail = tail.split(" ", 1)[1]
+        return tail.strip()
+
+    @staticmethod
+    def _split_keep(pattern, text: str):
+        """Divide text por pattern devolviendo (trozo, separador que lo precede) con el separador original."""
+        pieces, start, sep = [], 0, ""
+        for match in pattern.finditer(text):
+            pieces.append((text[start:match.start()], sep))
+            start, sep = match.end(), match.group()
+        pieces.append((text[start:], sep))
+        return pieces
+
+    @classmethod
+    def _split_text(cls, text: str, max_chars: int):
+        """Trocea text en fragmentos de como mucho max_chars.
+
+        Devuelve una lista de (fragmento, separador) donde separador es el texto exacto
+        que lo unía al fragmento anterior, de modo que concatenar separadores y
+        fragmentos en orden reproduce text sin cambios.
+        """
+        if len(text) <= max_chars:
+            return [(text, "")]
+
+        # Unidades indivisibles con el separador que las precede
+        units = []
+        for paragraph, separator in cls._split_keep(PARAGRAPH_SPLIT, text):
+            if len(paragraph) <= max_chars:
+                pieces = [(paragraph, separator)]
+            else:
+                pieces = cls._split_keep(SENTENCE_SPLIT, paragraph)
+                pieces[0] = (pieces[0][0], separator)
+            for piece, sep in pieces:
+                while len(piece) > max_chars:
+                    # Frase sin puntuación más larga que un fragmento: cortar por palabras
+                    cut = piece.rfind(" ", 0, max_chars)
+                    if cut > 0:
+                        units.append((piece[:cut], sep))
+                        piece, sep = piece[cut + 1:], " "
+                    else:
+                        units.append((piece[:max_chars], sep))
+                        piece, sep = piece[max_chars:], ""
+                if piece or sep:
+                    units.append((piece, sep))
+
+        chunks = []
+        current, current_sep = None, ""
+        for unit, sep in units:
+            if current is not None and len(current) + len(sep) + len(unit) <= max_chars:
+                current += sep + unit
+            else:
+                if current is not None:
+                    chunks.append((current, current_sep))
+                current, current_sep = unit, sep
+        if current is not None:
+            chunks.append((current, current_sep))
+        return chunks
+
+    @staticmethod
+    def _merge_usage(usage: Dict, kind: str, records):
+        """Suma el uso de varias peticiones (una por fragmento) en un único registro."""
+        records = [r for r in records if r]
+        if not records:
+            return
+        merged = {'model': records[0]['model'], 'chunks': len(records)}
+        for field in ('prompt_tokens', 'audio_tokens', 'output_tokens', 'total_tokens', 'request_bytes', 'response_bytes'):
+            merged[field] = sum(r.get(field, 0) for r in records)
+        usage[kind] = merged
+
+    def _get_model(self):
+        """Devuelve el GenerativeModel del modelo actual, creándolo una sola vez."""
+        model = self._models.get(self.model)
+        if model is None:
+            model = self._models.setdefault(self.model, genai.GenerativeModel(model_name=self.model))
+        return model
+
+    def _ping_files(self):
+        """Petición mínima por el cliente HTTP que usa upload_file; debe ejecutarse en el hilo de subidas.
+
+        upload_file no usa el transporte de list_files/get_model, sino un cliente
+        construido a partir del documento de descubrimiento de la API, que se descarga
+        la primera vez y se guarda por hilo. Aquí se crea (si falta) y se reutiliza.
+        """
+        try:
+            file_client = genai.client.get_default_file_client()
+        except AttributeError:
+            file_client = None
+        setup = getattr(file_client, '_setup_discovery_api', None)
+        if setup is None:
+            # Versión del SDK sin cliente de descubrimiento: basta con el servicio de archivos
+            next(iter(genai.list_files(page_size=1)), None)
+            return
+
+        def discovery_api():
+            local = getattr(file_client, '_local', None)
+            return getattr(local, 'discovery_api', None) or getattr(file_client, '_discovery_api', None)
+
+        api = discovery_api()
+        if api is None:
+            setup()
+            api = discovery_api()
+        api.files().list(pageSize=1).execute()
+
+    def _ping(self):
+        """Ejercita las dos conexiones de un dictado: subida de audio y generate_content."""
+        self._upload_executor.submit(self._ping_files).result()
+        # count_tokens va por el mismo cliente que generate_content y no consume cuota de generación
+        self._get_model().count_tokens("hola")
+
+    def _mark_activity(self):
+        self._last_api_activity = time.monotonic()
+        if self._keepalive_thread is None:
+            with self._warm_lock:
+                if self._keepalive_thread is None:
+                    self._keepalive_thread = threading.Thread(target=self._keepalive, name="gemini-keepalive",
+                                                              daemon=True)
+                    self._keepalive_thread.start()
+
+    def _keepalive(self):
+        """Mantiene abiertas las conexiones mientras el usuario sigue dictando."""
+        while not self._keepalive_stop.wait(KEEPALIVE_INTERVAL):
+            if not self.is_configured or time.monotonic() - self._last_api_activity > KEEPALIVE_IDLE:
+                continue
+            try:
+                with self._warm_lock:
+                    self._ping()
+            except Exception as e:
+                logging.debug(f"Keep-alive con Gemini fallido: {e}")
+
+    def warm_up(self) -> Optional[float]:
+        """Abre por adelantado las conexiones con la API (DNS, TLS, documento de descubrimiento).
+
+        Pensado para llamarse en segundo plano al empezar a grabar. Devuelve los
+        segundos medidos (pocos milisegundos si el keep-alive mantuvo la conexión),
+        o None si falló.
+        """
+        if not self.is_configured:
+            return None
+        with self._warm_lock:
+            inicio = time.perf_counter()
+            try:
+                self._ping()
+            except Exception as e:
+                logging.warning(f"No se pudo precalentar la conexión con Gemini: {e}")
+                return None
+            elapsed = time.perf_counter() - inicio
+        self._mark_activity()
+        logging.info(f"Conexión con Gemini precalentada en {elapsed:.3f}s")
+        return elapsed
+
     def set_api_key(self, api_key: str) -> bool:
         """Establece una nueva API key, la configura y la guarda."""
         self.api_key = api_key
@@ -126,8 +387,11 @@ class TextEnhancer:
     def get_model(self) -> str:
         return self.model
 
-    def transcribe_audio(self, audio_file_path: str) -> str:
-        """Transcribe un archivo de audio usando la API de Gemini."""
+    def transcribe_audio(self, audio_file_path: str, usage: Optional[Dict] = None) -> str:
+        """Transcribe un archivo de audio usando la API de Gemini.
+
+        Si se pasa usage, se rellena usage['transcription'] con tokens y bytes de la petición.
+        """
         if not self.is_configured:
             raise Exception("API de Gemini no configurada. Añada su API Key en Configuración.")
 
@@ -135,11 +399,11 @@ class TextEnhancer:
             logging.info(f"Transcribiendo archivo de audio: {audio_file_path}")
             
             # Subir el archivo de audio a la API de Gemini
-            audio_file = genai.upload_file(path=audio_file_path)
+            audio_file = self._upload_executor.submit(genai.upload_file, path=audio_file_path).result()
             logging.info(f"Archivo subido: {audio_file.display_name}")
 
-            # Crear el modelo generativo
-            model = genai.GenerativeModel(model_name=self.model)
+            # Reutilizar el modelo generativo (y su conexión) entre dictados
+            model = self._get_model()
 
             # Prompt para la transcripción
             prompt = """
@@ -156,7 +420,10 @@ class TextEnhancer:
                 raise Exception("La API de Gemini no devolvió una respuesta válida.")
             
             texto_transcrito = response.text.strip()
+            self._mark_activity()
             logging.info("Transcripción completada exitosamente.")
+            request_bytes = os.path.getsize(audio_file_path) + len(prompt.encode('utf-8'))
+            self._record_usage(usage, 'transcription', response, request_bytes, response.text)
             
             # Limpiar el archivo subido de la API de Gemini
             try:
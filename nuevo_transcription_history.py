@@ -1,14 +1,122 @@
 import json
 import os
+import csv
+import hashlib
+import heapq
+import sys
+import tempfile
+import time
+from array import array
+from bisect import bisect_left
 from datetime import datetime, timedelta
-from typing import Dict, List
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
 import logging
+import threading
+
+# Campos numéricos de uso que se acumulan en las estadísticas
+USAGE_FIELDS = ('prompt_tokens', 'audio_tokens', 'output_tokens', 'total_tokens', 'request_bytes', 'response_bytes')
+
+# Columnas de la exportación CSV
+CSV_FIELDS = ('timestamp', 'text', 'duration', 'used_gemini', 'mode', 'usage')
+READ_CHUNK = 64 * 1024
+
+class TranscriptionEntry:
+    """Entrada de historial compacta: fecha como epoch y modo internado.
+
+    La fecha ISO del archivo se convierte una sola vez al cargar para ordenar y
+    filtrar; se conserva también el texto original (con su zona horaria, si la
+    tiene) para que to_dict devuelva exactamente lo guardado.
+    """
+    __slots__ = ('timestamp', 'iso', 'text', 'duration', 'used_gemini', 'mode', 'usage', 'timings')
+
+    def __init__(self, timestamp: float, text: str, duration: float, used_gemini: bool, mode: str,
+                 usage: Optional[Dict] = None, timings: Optional[Dict] = None, iso: Optional[str] = None):
+        self.timestamp = timestamp
+        self.iso = iso or datetime.fromtimestamp(timestamp).isoformat()
+        self.text = text
+        self.duration = duration
+        self.used_gemini = used_gemini
+        self.mode = sys.intern(mode)
+        self.usage = usage
+        self.timings = timings
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'TranscriptionEntry':
+        """Crea la entrada a partir del dict del archivo; lanza ValueError/TypeError si está mal formada."""
+        try:
+            return cls(
+                datetime.fromisoformat(data['timestamp']).timestamp(),
+                data['text'],
+                float(data.get('duration', 0.0)),
+                bool(data.get('used_gemini', False)),
+                data.get('mode') or "gemini_only",
+                data.get('usage'),
+                data.get('timings'),
+                data['timestamp']
+            )
+        except KeyError as e:
+            raise ValueError(f"falta el campo {e}")
+
+    def to_dict(self) -> Dict:
+        data = {
+            'timestamp': self.iso,
+            'text': self.text,
+            'duration': self.duration,
+            'used_gemini': self.used_gemini,
+            'mode': self.mode
+        }
+        if self.usage:
+            data['usage'] = self.usage
+        if self.timings:
+            data['timings'] = self.timings
+        return data
+
+class HistoryColumns:
+    """Columnas numéricas del historial ordenadas por fecha, para estadísticas por rangos.
+
+    Los conteos por intervalo se resuelven con una búsqueda binaria sobre las fechas
+    y sumas prefijas de used_gemini, sin recorrer las entradas una a una.
+    """
+    __slots__ = ('timestamps', 'durations', 'gemini_prefix')
+
+    def __init__(self, entries: List[TranscriptionEntry]):
+        ordered = sorted(entries, key=lambda entry: entry.timestamp)
+        self.timestamps = array('d', [entry.timestamp for entry in ordered])
+        self.durations = array('d', [entry.duration for entry in ordered])
+        # gemini_prefix[i] = entradas con Gemini entre las i primeras
+        self.gemini_prefix = array('q', [0])
+        total = 0
+        for entry in ordered:
+            total += entry.used_gemini
+            self.gemini_prefix.append(total)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def count_since(self, since: float) -> Dict:
+        """Entradas (totales y con Gemini) con fecha >= since."""
+        index = bisect_left(self.timestamps, since)
+        return {'total': len(self.timestamps) - index, 'gemini': self.gemini_prefix[-1] - self.gemini_prefix[index]}
+
+    def total_duration(self) -> float:
+        return sum(self.durations)
+
+    def total_gemini(self) -> int:
+        return self.gemini_prefix[-1]
 
 class TranscriptionHistory:
     def __init__(self, history_file: str = "nuevo_transcription_history.json", max_entries: int = 1000):
         self.history_file = history_file
         self.stats_file = "nuevo_usage_statistics.json" # Archivo de estadísticas separado
         self.max_entries = max_entries
+        # Varios hilos (pool de dictados, servidor) pueden escribir a la vez
+        self._lock = threading.Lock()
+        # Entradas ya convertidas, válidas mientras el archivo no cambie (mtime + tamaño)
+        self._entries: Optional[List[TranscriptionEntry]] = None
+        self._columns: Optional[HistoryColumns] = None
+        self._columns_source: Optional[List[TranscriptionEntry]] = None
+        self._cache_stat = None
         self._ensure_files_exist()
 
     def _ensure_files_exist(self):
@@ -27,27 +135,50 @@ class TranscriptionHistory:
             except Exception as e:
                 logging.error(f"No se pudo crear el archivo de estadísticas {self.stats_file}: {e}")
 
-    def add_transcription(self, text: str, duration: float, used_gemini: bool = False, mode: str = "gemini_only") -> None:
-        """Añade una nueva transcripción al historial."""
+    def add_transcription(self, text: str, duration: float, used_gemini: bool = False, mode: str = "gemini_only",
+                          usage: Optional[Dict] = None, timings: Optional[Dict] = None,
+                          timestamp: Optional[str] = None) -> None:
+        """Añade una nueva transcripción al historial.
+
+        usage guarda los tokens y bytes de cada petición a Gemini, por tipo de petición.
+        timings guarda los segundos de cada etapa (conexión, transcripción, mejora).
+        timestamp permite registrar la hora original de un dictado procesado más tarde.
+        """
         try:
             entry = {
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': timestamp or datetime.now().isoformat(),
                 'text': text,
                 'duration': duration,
                 'used_gemini': used_gemini,
                 'mode': mode
             }
+            if usage:
+                entry['usage'] = usage
+            if timings:
+                entry['timings'] = timings
             
-            with open(self.history_file, 'r+', encoding='utf-8') as f:
-                history = json.load(f)
-                history.insert(0, entry)
-                
-                if len(history) > self.max_entries:
-                    history = history[:self.max_entries]
+            with self._lock:
+                cache_valid = self._entries is not None and self._cache_stat == self._stat()
+                with open(self.history_file, 'r+', encoding='utf-8') as f:
+                    history = json.load(f)
+                    # La caché solo se actualiza en sitio si refleja exactamente el archivo
+                    cache_valid = cache_valid and len(self._entries) == len(history)
+                    history.insert(0, entry)
+                    
+                    if len(history) > self.max_entries:
+                        history = history[:self.max_entries]
+                    
+                    f.seek(0)
+                    json.dump(history, f, ensure_ascii=False, indent=2)
+                    f.truncate()
                 
-                f.seek(0)
-                json.dump(history, f, ensure_ascii=False, indent=2)
-                f.truncate()
+                if cache_valid:
+                    # Lista nueva: quien esté recorriendo la anterior fuera del lock no la ve cambiar
+                    self._entries = [TranscriptionEntry.from_dict(entry)] + self._entries[:self.max_entries - 1]
+                    self._columns = None
+                    self._cache_stat = self._stat()
+                else:
+                    self._entries = None
             
         except Exception as e:
             logging.error(f"Error al añadir transcripción al historial: {e}")
@@ -58,26 +189,73 @@ class TranscriptionHistory:
             if not os.path.exists(self.history_file):
                 return []
                 
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                history = json.load(f)
-                return history[:limit]
-        except (json.JSONDecodeError, FileNotFoundError) as e:
+            # Solo se decodifican las primeras entradas, no el archivo completo
+            return list(islice(self.iter_entries(), limit))
+        except (json.JSONDecodeError, ValueError, FileNotFoundError) as e:
             logging.error(f"Error al leer el historial {self.history_file}: {e}")
             return []
         except Exception as e:
             logging.error(f"Error inesperado al leer el historial: {e}")
             return []
 
-    def search_transcriptions(self, query: str) -> List[Dict]:
-        """Busca transcripciones que contengan el texto especificado."""
+    def _stat(self):
         try:
+            st = os.stat(self.history_file)
+            return (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            return None
+
+    def _load_entries(self) -> List[TranscriptionEntry]:
+        """Devuelve las entradas convertidas, releyendo el archivo solo si ha cambiado.
+
+        La lista devuelta no se modifica nunca en sitio; los cambios la sustituyen por otra.
+        """
+        with self._lock:
+            current = self._stat()
+            if self._entries is not None and current == self._cache_stat:
+                return self._entries
+            entries = []
             with open(self.history_file, 'r', encoding='utf-8') as f:
                 history = json.load(f)
-                return [entry for entry in history if query.lower() in entry['text'].lower()]
+            for data in history:
+                try:
+                    entries.append(TranscriptionEntry.from_dict(data))
+                except (ValueError, TypeError) as e:
+                    logging.warning(f"Saltando entrada de historial mal formada: {data}. Error: {e}")
+            self._entries = entries
+            self._columns = None
+            self._cache_stat = current
+            return entries
+
+    def _load_columns(self, entries: List[TranscriptionEntry]) -> HistoryColumns:
+        with self._lock:
+            if self._columns is not None and self._columns_source is entries:
+                return self._columns
+            columns = HistoryColumns(entries)
+            # Solo se cachean las columnas de la lista vigente, no las de una copia antigua
+            if entries is self._entries:
+                self._columns, self._columns_source = columns, entries
+            return columns
+
+    def search_transcriptions(self, query: str) -> List[Dict]:
+        """Busca transcripciones que contengan el texto especificado."""
+        try:
+            query = query.lower()
+            return [entry.to_dict() for entry in self._load_entries() if query in entry.text.lower()]
         except Exception as e:
             logging.error(f"Error al buscar en el historial: {e}")
             return []
 
+    @staticmethod
+    def _add_usage(bucket: Dict, record: Dict) -> None:
+        """Acumula un registro de uso (tokens y bytes de una petición) en bucket."""
+        bucket['requests'] = bucket.get('requests', 0) + 1
+        for field in USAGE_FIELDS:
+            value = record.get(field, 0)
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                value = 0
+            bucket[field] = bucket.get(field, 0) + value
+
     def get_statistics(self) -> Dict:
         """Calcula estadísticas a partir del historial de transcripciones."""
         default_stats = {
@@ -86,66 +264,247 @@ class TranscriptionHistory:
             'last_month': {'total': 0, 'gemini': 0},
             'total_duration': 0,
             'avg_duration': 0,
-            'total_gemini_requests': 0
+            'total_gemini_requests': 0,
+            'usage_by_day': {},
+            'usage_by_model': {}
         }
         
         try:
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                history = json.load(f)
-                
-            if not history:
+            entries = self._load_entries()
+            columns = self._load_columns(entries)
+            if not len(columns):
                 return default_stats
 
-            now = datetime.now()
-            last_24h_limit = now - timedelta(hours=24)
-            last_week_limit = now - timedelta(days=7)
-            last_month_limit = now - timedelta(days=30)
-            
+            now = time.time()
             stats = {
-                'last_24h': {'total': 0, 'gemini': 0},
-                'last_week': {'total': 0, 'gemini': 0},
-                'last_month': {'total': 0, 'gemini': 0},
-                'total_duration': 0.0,
-                'total_gemini_requests': 0
+                'last_24h': columns.count_since(now - timedelta(hours=24).total_seconds()),
+                'last_week': columns.count_since(now - timedelta(days=7).total_seconds()),
+                'last_month': columns.count_since(now - timedelta(days=30).total_seconds()),
+                'total_duration': columns.total_duration(),
+                'total_gemini_requests': columns.total_gemini(),
+                'usage_by_day': {},
+                'usage_by_model': {}
             }
+            stats['avg_duration'] = stats['total_duration'] / len(columns)
             
-            total_entries = len(history)
-            
-            for entry in history:
-                try:
-                    timestamp = datetime.fromisoformat(entry['timestamp'])
-                    duration = float(entry.get('duration', 0.0))
-                    used_gemini = entry.get('used_gemini', False)
-                    
-                    if timestamp >= last_24h_limit:
-                        stats['last_24h']['total'] += 1
-                        if used_gemini:
-                            stats['last_24h']['gemini'] += 1
-                            
-                    if timestamp >= last_week_limit:
-                        stats['last_week']['total'] += 1
-                        if used_gemini:
-                            stats['last_week']['gemini'] += 1
-
-                    if timestamp >= last_month_limit:
-                        stats['last_month']['total'] += 1
-                        if used_gemini:
-                            stats['last_month']['gemini'] += 1
-                    
-                    stats['total_duration'] += duration
-                    if used_gemini:
-                        stats['total_gemini_requests'] += 1
-                except (ValueError, TypeError) as e:
-                    logging.warning(f"Saltando entrada de historial mal formada: {entry}. Error: {e}")
-                    total_entries -= 1 # No contar entradas corruptas para el promedio
-            
-            if total_entries > 0:
-                stats['avg_duration'] = stats['total_duration'] / total_entries
-            else:
-                stats['avg_duration'] = 0.0
+            # Solo las entradas con datos de consumo necesitan recorrerse
+            for entry in entries:
+                if not entry.usage or not isinstance(entry.usage, dict):
+                    continue
+                day = time.strftime('%Y-%m-%d', time.localtime(entry.timestamp))
+                for record in entry.usage.values():
+                    # Un registro mal formado no debe anular el resto de las estadísticas
+                    if not isinstance(record, dict):
+                        continue
+                    self._add_usage(stats['usage_by_day'].setdefault(day, {}), record)
+                    self._add_usage(stats['usage_by_model'].setdefault(record.get('model', 'desconocido'), {}), record)
             
             return stats
             
         except Exception as e:
             logging.error(f"Error al obtener estadísticas: {e}")
-            return default_stats
\ No newline at end of file
+            return default_stats
+
+    def iter_entries(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Iterator[Dict]:
+        """Recorre el historial entrada a entrada sin cargar el archivo entero en memoria.
+
+        start y end (inclusive) filtran por la fecha de la transcripción.
+        """
+        decoder = json.JSONDecoder()
+        with open(self.history_file, 'r', encoding='utf-8') as f:
+            buffer = f.read(READ_CHUNK).lstrip()
+            if not buffer:
+                return
+            if buffer[0] != '[':
+                raise ValueError(f"{self.history_file} no contiene una lista JSON")
+            pos = 1
+            while True:
+                while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos >= len(buffer):
+                    buffer, pos = f.read(READ_CHUNK), 0
+                    if not buffer:
+                        return
+                    continue
+                if buffer[pos] == ']':
+                    return
+                try:
+                    entry, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    # Entrada partida entre dos bloques: leer más y reintentar
+                    more = f.read(READ_CHUNK)
+                    if not more:
+                        raise
+                    buffer, pos = buffer[pos:] + more, 0
+                    continue
+                if self._in_range(entry, start, end):
+                    yield entry
+
+    @staticmethod
+    def _epoch(value) -> float:
+        """Fecha ISO (con o sin zona horaria) a epoch; las fechas sin zona se toman como hora local."""
+        if isinstance(value, datetime):
+            return value.timestamp()
+        if not isinstance(value, str):
+            raise TypeError(f"fecha no válida: {value!r}")
+        return datetime.fromisoformat(value).timestamp()
+
+    @classmethod
+    def _in_range(cls, entry: Dict, start: Optional[datetime], end: Optional[datetime]) -> bool:
+        if start is None and end is None:
+            return True
+        try:
+            timestamp = cls._epoch(entry['timestamp'])
+        except (KeyError, ValueError, TypeError):
+            return False
+        # Se compara en epoch para poder mezclar fechas con y sin zona horaria
+        return (start is None or timestamp >= cls._epoch(start)) and (end is None or timestamp <= cls._epoch(end))
+
+    @classmethod
+    def _validate_record(cls, entry) -> float:
+        """Comprueba un registro importado y devuelve su fecha en epoch; lanza ValueError si no es válido."""
+        if not isinstance(entry, dict):
+            raise ValueError("no es un objeto")
+        try:
+            epoch = cls._epoch(entry.get('timestamp'))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"timestamp no válido: {e}")
+        if not isinstance(entry.get('text'), str):
+            raise ValueError("text debe ser una cadena")
+        usage = entry.get('usage')
+        if usage is not None and not (isinstance(usage, dict) and all(isinstance(r, dict) for r in usage.values())):
+            raise ValueError("usage debe ser un objeto de objetos")
+        if entry.get('timings') is not None and not isinstance(entry['timings'], dict):
+            raise ValueError("timings debe ser un objeto")
+        return epoch
+
+    @staticmethod
+    def _entry_key(entry: Dict) -> tuple:
+        """Clave de deduplicación: fecha y hash del texto."""
+        digest = hashlib.sha1(entry.get('text', '').encode('utf-8')).digest()
+        return (entry.get('timestamp'), digest)
+
+    @staticmethod
+    def _detect_format(path: str, fmt: Optional[str]) -> str:
+        fmt = (fmt or os.path.splitext(path)[1].lstrip('.')).lower()
+        if fmt not in ('jsonl', 'csv'):
+            raise ValueError(f"Formato no soportado: {fmt!r} (use jsonl o csv)")
+        return fmt
+
+    def export_history(self, path: str, fmt: Optional[str] = None,
+                       start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+        """Exporta el historial a JSONL o CSV en streaming. Devuelve el número de entradas."""
+        fmt = self._detect_format(path, fmt)
+        count = 0
+        with self._lock, open(path, 'w', encoding='utf-8', newline='') as out:
+            if fmt == 'jsonl':
+                for entry in self.iter_entries(start, end):
+                    out.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                    count += 1
+            else:
+                writer = csv.DictWriter(out, fieldnames=CSV_FIELDS, extrasaction='ignore')
+                writer.writeheader()
+                for entry in self.iter_entries(start, end):
+                    row = dict(entry)
+                    row['usage'] = json.dumps(entry['usage'], ensure_ascii=False) if entry.get('usage') else ''
+                    writer.writerow(row)
+                    count += 1
+        logging.info(f"Exportadas {count} transcripciones a {path}")
+        return count
+
+    @staticmethod
+    def _read_jsonl(path: str) -> Iterator[Dict]:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    logging.warning(f"Saltando línea {line_number} mal formada de {path}: {e}")
+
+    @staticmethod
+    def _read_csv(path: str) -> Iterator[Dict]:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                try:
+                    entry = {
+                        'timestamp': row['timestamp'],
+                        'text': row['text'],
+                        'duration': float(row.get('duration') or 0.0),
+                        'used_gemini': str(row.get('used_gemini', '')).lower() in ('true', '1'),
+                        'mode': row.get('mode') or "gemini_only"
+                    }
+                    if row.get('usage'):
+                        entry['usage'] = json.loads(row['usage'])
+                    yield entry
+                except (KeyError, ValueError) as e:
+                    logging.warning(f"Saltando fila mal formada de {path}: {e}")
+
+    def _write_atomic(self, history: List[Dict]) -> None:
+        """Reescribe el historial completo en un temporal y lo sustituye de una vez."""
+        directory = os.path.dirname(os.path.abspath(self.history_file))
+        fd, temp_path = tempfile.mkstemp(prefix=".history-", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(history, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.history_file)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+
+    @classmethod
+    def _sort_key(cls, entry: Dict) -> float:
+        try:
+            return cls._epoch(entry.get('timestamp'))
+        except (ValueError, TypeError):
+            return 0.0
+
+    def import_history(self, path: str, fmt: Optional[str] = None,
+                       start: Optional[datetime] = None, end: Optional[datetime] = None) -> int:
+        """Importa transcripciones desde JSONL o CSV, sin duplicados (fecha + hash del texto).
+
+        Solo se conservan en memoria las max_entries entradas más recientes, así que
+        el consumo no depende del tamaño del archivo importado. Devuelve cuántas se añadieron.
+        """
+        fmt = self._detect_format(path, fmt)
+        records: Iterable[Dict] = self._read_jsonl(path) if fmt == 'jsonl' else self._read_csv(path)
+
+        with self._lock:
+            existing = list(self.iter_entries())
+            keys = {self._entry_key(entry) for entry in existing}
+            # Montículo con las entradas importadas más recientes: (timestamp, orden, entrada)
+            heap = []
+            for order, entry in enumerate(records):
+                try:
+                    epoch = self._validate_record(entry)
+                except ValueError as e:
+                    logging.warning(f"Saltando registro {order + 1} no válido de {path}: {e}")
+                    continue
+                if not self._in_range(entry, start, end):
+                    continue
+                key = self._entry_key(entry)
+                if key in keys:
+                    continue
+                item = (epoch, order, entry)
+                if len(heap) < self.max_entries:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    evicted = heapq.heapreplace(heap, item)
+                    keys.discard(self._entry_key(evicted[2]))
+                else:
+                    continue
+                keys.add(key)
+
+            imported = [item[2] for item in heap]
+            merged = sorted(existing + imported, key=self._sort_key, reverse=True)
+            merged = merged[:self.max_entries]
+            imported_ids = {id(entry) for entry in imported}
+            added = sum(1 for entry in merged if id(entry) in imported_ids)
+            self._write_atomic(merged)
+
+        logging.info(f"Importadas {added} transcripciones desde {path}")
+        return added